@@ -0,0 +1,538 @@
+#!/usr/bin/python3
+
+import io
+import os.path
+import random
+import sys
+import tempfile
+import time
+
+import homelabel
+import inventory
+import labelcreator
+import labelpreview
+import labelsheet
+import raster
+import textindex
+
+
+from reportlab.pdfgen.canvas import Canvas
+from reportlab.platypus import Frame
+
+
+def timed(function, *args, repeat=5, **kwargs):
+    best = None
+
+    for attempt in range(repeat):
+        start = time.perf_counter()
+        result = function(*args, **kwargs)
+        elapsed = time.perf_counter() - start
+
+        if best is None or elapsed < best:
+            best = elapsed
+
+    return best, result
+
+
+class CountingPreview(labelpreview.LabelPreview):
+    def __init__(self, *args, **kwargs):
+        super(CountingPreview, self).__init__(*args, **kwargs)
+        self.measures = 0
+        self.rasters = 0
+
+    def _measure_text(self, font_size):
+        self.measures += 1
+        return super(CountingPreview, self)._measure_text(font_size)
+
+    def _draw_text_block(self, font_size):
+        self.rasters += 1
+        return super(CountingPreview, self)._draw_text_block(font_size)
+
+
+def legacy_fit(preview, area_size):
+    # The original loop: every attempt measures all three lines and
+    # allocates a full canvas, shrinking the font by 7/8 until it fits.
+    font_size = 256
+    for attempt in range(50):
+        used_size = preview.measure_text(font_size)
+        labelpreview.PIL.Image.new('RGB', area_size, color='white')
+
+        if preview.text_fits(used_size, area_size):
+            preview._draw_text_block(font_size)
+            return font_size
+
+        font_size = 7 * font_size // 8
+
+    return None
+
+
+def new_fit(preview, area_size):
+    font_size, used_size = preview.fit_font_size(area_size)
+
+    if font_size:
+        preview.text_block(font_size)
+
+    return font_size
+
+
+def bench_font_fit():
+    titles = (
+            ('short', 'Animal', 'Llama', ''),
+            ('typical', 'Hardware', 'Zip ties', '200 mm black'),
+            ('very long', 'Electronics', 'Assorted resistors 1/4W', 'E12 series 10R to 1M, 25 of each'),
+            )
+
+    # Text area of the 325x100 preview icons, after the QR and after the
+    # double sticker split.
+    areas = ((225, 100), (58, 100))
+
+    print('{:10} {:>9}  {:>17}  {:>17}  {:>9}  {:>9}'.format(
+        'title', 'area', 'legacy size/pass', 'new size/pass', 'legacy ms', 'new ms',
+        ))
+
+    for name, category, title, subtitle in titles:
+        for area in areas:
+            rows = []
+
+            for fit in (legacy_fit, new_fit):
+                preview = CountingPreview(category, title, subtitle)
+
+                font_size = fit(preview, area)
+
+                # A legacy attempt measures and allocates a canvas in one
+                # pass; the new path measures separately and rasterizes once.
+                if fit is legacy_fit:
+                    passes = preview.measures
+                else:
+                    passes = preview.measures + preview.rasters
+
+                elapsed, _ = timed(
+                        lambda: fit(CountingPreview(category, title, subtitle), area),
+                        )
+
+                rows.append((font_size, passes, elapsed))
+
+            (legacy_size, legacy_passes, legacy_time), (new_size, new_passes, new_time) = rows
+
+            print('{:10} {:>9}  {:>8} / {:<6}  {:>8} / {:<6}  {:9.2f}  {:9.2f}'.format(
+                name,
+                '{}x{}'.format(*area),
+                legacy_size,
+                legacy_passes,
+                new_size,
+                new_passes,
+                legacy_time * 1000,
+                new_time * 1000,
+                ))
+
+    print()
+    print('font cache:', labelpreview.fonts.stats())
+
+
+def bench_preview_formats():
+    # The four sticker buttons of the labeler.
+    formats = (
+            ((325, 100), 1),
+            ((325, 100), 2),
+            ((325, 95), 1),
+            ((325, 95), 2),
+            )
+
+    def separate(category, title, subtitle):
+        previews = [CountingPreview(category, title, subtitle) for f in formats]
+        for preview, (size, subparts) in zip(previews, formats):
+            preview.render(size=size, subparts=subparts)
+        return previews
+
+    def shared(category, title, subtitle):
+        preview = CountingPreview(category, title, subtitle)
+        for size, subparts in formats:
+            preview.render(size=size, subparts=subparts)
+        return [preview]
+
+    print('{:10} {:>20}  {:>20}  {:>11}  {:>9}'.format(
+        'title', 'separate meas/rast', 'shared meas/rast', 'separate ms', 'shared ms',
+        ))
+
+    for name, text in (
+            ('short', ('Animal', 'Llama', '')),
+            ('typical', ('Hardware', 'Zip ties', '200 mm black')),
+            ('very long', ('Electronics', 'Assorted resistors 1/4W', 'E12 series 10R to 1M')),
+            ):
+        row = [name]
+        times = []
+
+        for strategy in (separate, shared):
+            previews = strategy(*text)
+            row.append('{} / {}'.format(
+                sum(p.measures for p in previews),
+                sum(p.rasters for p in previews),
+                ))
+
+            elapsed, _ = timed(strategy, *text)
+            times.append(elapsed * 1000)
+
+        print('{:10} {:>20}  {:>20}  {:11.2f}  {:9.2f}'.format(*row, *times))
+
+
+def bench_qr_pdf():
+    labels = [
+            homelabel.Label('Item {:04}'.format(i), add_serial=False)
+            for i in range(12)
+            ]
+
+    print('{:8} {:>10}  {:>9}'.format('qr', 'pdf bytes', 'ms'))
+
+    for vector_qr in (False, True):
+        def make_pdf():
+            with io.BytesIO() as F:
+                homelabel.LabelPage(labels, vector_qr=vector_qr).make_page(F)
+                return len(F.getvalue())
+
+        elapsed, size = timed(make_pdf)
+
+        print('{:8} {:10}  {:9.2f}'.format(
+            'vector' if vector_qr else 'raster',
+            size,
+            elapsed * 1000,
+            ))
+
+
+def bench_parallel_pdf(count=600):
+    print('{:8} {:>7}  {:>9}  {:>7}'.format('qr', 'workers', 's', 'speedup'))
+
+    for vector_qr in (False, True):
+        baseline = None
+
+        for workers in (None, 1, 2, 4, 8):
+            labels = (
+                    homelabel.Label('Item {:05}'.format(i), add_serial=False)
+                    for i in range(count)
+                    )
+            page = homelabel.LabelPage(labels, vector_qr=vector_qr, workers=workers)
+
+            start = time.perf_counter()
+            with io.BytesIO() as F:
+                page.make_page(F)
+            elapsed = time.perf_counter() - start
+
+            if baseline is None:
+                baseline = elapsed
+
+            print('{:8} {:>7}  {:9.2f}  {:7.2f}'.format(
+                'vector' if vector_qr else 'raster',
+                workers or '-',
+                elapsed,
+                baseline / elapsed,
+                ))
+
+
+def bench_qr_copies(count=120):
+    jobs = (
+            ('distinct', ['Item {:04}'.format(i) for i in range(count)]),
+            ('copies', ['Item 0000'] * count),
+            )
+
+    print('{:8} {:8} {:>10}  {:>9}'.format('qr', 'labels', 'pdf bytes', 'ms'))
+
+    for vector_qr in (False, True):
+        for name, texts in jobs:
+            def make_pdf():
+                homelabel.make_qr_matrix.cache_clear()
+
+                labels = (homelabel.Label(text, add_serial=False) for text in texts)
+                with io.BytesIO() as F:
+                    homelabel.LabelPage(labels, vector_qr=vector_qr).make_page(F)
+                    return len(F.getvalue())
+
+            elapsed, size = timed(make_pdf, repeat=3)
+
+            print('{:8} {:8} {:10}  {:9.2f}'.format(
+                'vector' if vector_qr else 'raster',
+                name,
+                size,
+                elapsed * 1000,
+                ))
+
+
+def bench_raster():
+    # What has to exist before lp can be called: the creator's one-label PDF,
+    # which CUPS still has to rasterize, or the finished raster stream.
+    def make_pdf():
+        homelabel.make_qr_matrix.cache_clear()
+
+        label = homelabel.Label('Resistor kit 0805', add_serial=False)
+        with io.BytesIO() as F:
+            homelabel.LabelPage([label]).make_page(F)
+            return len(F.getvalue())
+
+    def make_raster(format, dither):
+        homelabel.make_qr_matrix.cache_clear()
+
+        preview = raster.inventory_preview(
+                'Electronics',
+                'Resistor kit 0805',
+                'E24 series',
+                )
+        image = raster.render(preview, (90, 29))
+        bits = raster.bitmap(image, dither=dither)
+        return len(raster.encoders[format](bits, 300))
+
+    print('{:6} {:9} {:>10}  {:>9}'.format('output', 'pixels', 'bytes', 'ms'))
+
+    elapsed, size = timed(make_pdf)
+    print('{:6} {:9} {:10}  {:9.2f}'.format('pdf', '-', size, elapsed * 1000))
+
+    for format in ('pbm', 'pwg'):
+        for dither in (False, True):
+            elapsed, size = timed(make_raster, format, dither)
+
+            print('{:6} {:9} {:10}  {:9.2f}'.format(
+                format,
+                'dither' if dither else 'threshold',
+                size,
+                elapsed * 1000,
+                ))
+
+
+def bench_inventory_lookup(rows=1000000, lookups=1000):
+    categories = ['Category {:03}'.format(i) for i in range(100)]
+
+    def entries():
+        for i in range(rows):
+            category = categories[i % len(categories)]
+            title = 'Item {:07}'.format(i)
+            yield inventory.InventoryEntry(
+                    'spool/{:}/{:}.txt'.format(
+                        labelcreator.escape(category),
+                        labelcreator.escape(title),
+                        ),
+                    category,
+                    title,
+                    'Shelf {:}'.format(i % 40),
+                    '{:03}'.format(i % 1000),
+                    )
+
+    wanted = [
+            random.Random(i).randrange(rows)
+            for i in range(lookups)
+            ]
+
+    with tempfile.TemporaryDirectory() as directory:
+        log = inventory.Inventory(os.path.join(directory, 'inventory.txt'))
+        store = inventory.SqliteInventory(os.path.join(directory, 'inventory.db'))
+
+        start = time.perf_counter()
+        log.append_many(entry.path for entry in entries())
+        log_build = time.perf_counter() - start
+
+        start = time.perf_counter()
+        batch = []
+        for entry in entries():
+            batch.append(entry)
+            if len(batch) == 10000:
+                store.append_many(batch)
+                batch = []
+        store.append_many(batch)
+        store_build = time.perf_counter() - start
+
+        print('{:6} {:>9}  {:>9}  {:>12}'.format(
+            'store', 'build s', 'len ms', 'lookup ms'))
+
+        # The text log only has paths, so the cheapest existence check is a
+        # scan for the escaped path; the spooled files are not even opened.
+        def log_lookup(i):
+            path = 'spool/{:}/{:}.txt'.format(
+                    labelcreator.escape(categories[i % len(categories)]),
+                    labelcreator.escape('Item {:07}'.format(i)),
+                    )
+            return any(line == path for line in log.contents())
+
+        def store_lookup(i):
+            return store.exists(
+                    category=categories[i % len(categories)],
+                    title='Item {:07}'.format(i),
+                    )
+
+        for name, build, container, lookup, count in (
+                ('text', log_build, log, log_lookup, 5),
+                ('sqlite', store_build, store, store_lookup, lookups),
+                ):
+            len_elapsed, length = timed(len, container)
+            assert length == rows
+
+            start = time.perf_counter()
+            assert all(lookup(i) for i in wanted[:count])
+            lookup_elapsed = (time.perf_counter() - start) / count
+
+            print('{:6} {:9.2f}  {:9.3f}  {:12.4f}'.format(
+                name,
+                build,
+                len_elapsed * 1000,
+                lookup_elapsed * 1000,
+                ))
+
+        store.close()
+
+
+def bench_text_search(items=100000):
+    rng = random.Random(0)
+    words = [
+            ''.join(rng.choice('abcdefghijklmnopqrstuvwxyz') for i in range(6))
+            for j in range(5000)
+            ] + ['zip', 'ties', 'cable', 'black', 'llama']
+
+    queries = ('zip ties', 'cable', 'black llama', words[17], words[3000])
+
+    with tempfile.TemporaryDirectory() as directory:
+        texts = []
+        for i in range(items):
+            path = os.path.join(directory, '{:06}.txt'.format(i))
+            text = '\n'.join((
+                'Category {:}'.format(i % 100),
+                'Item {:}'.format(i),
+                '',
+                ' '.join(rng.choice(words) for j in range(rng.randrange(5, 40))),
+                ))
+
+            with open(path, 'w') as F:
+                F.write(text)
+
+            texts.append((path, text))
+
+        index = textindex.TextIndex(os.path.join(directory, 'index'))
+
+        start = time.perf_counter()
+        for i in range(0, items, 1000):
+            index.add_texts(texts[i:i + 1000])
+        build = time.perf_counter() - start
+
+        print('{} items indexed in {:.1f} s'.format(items, build))
+        print()
+        print('{:16} {:>7}  {:>9}  {:>9}'.format(
+            'query', 'matches', 'grep ms', 'index ms'))
+
+        for query in queries:
+            terms = query.split()
+
+            # What answering it meant before: read every spooled file.
+            def grep():
+                matches = 0
+                for path, text in texts:
+                    with open(path) as F:
+                        content = F.read().lower()
+                    matches += any(term in content for term in terms)
+                return matches
+
+            grep_elapsed, matches = timed(grep, repeat=1)
+            index_elapsed, results = timed(index.search, query)
+
+            print('{:16} {:7}  {:9.1f}  {:9.2f}'.format(
+                query,
+                matches,
+                grep_elapsed * 1000,
+                index_elapsed * 1000,
+                ))
+
+        index.close()
+
+
+class CountingParagraph(labelsheet.Paragraph):
+    wraps = 0
+
+    def wrap(self, *args):
+        CountingParagraph.wraps += 1
+        return super(CountingParagraph, self).wrap(*args)
+
+
+def legacy_plain_fit(text, canvas, size):
+    # The original plainlabel loop: a new style, paragraph and Frame.add
+    # per attempt, shrinking by 5 % until the paragraph fits.
+    frame = Frame(
+            0,
+            0,
+            *size,
+            leftPadding=0,
+            bottomPadding=0,
+            rightPadding=0,
+            topPadding=0,
+            )
+
+    font_size = 32
+    for attempt in range(50):
+        style = labelsheet.paragraph_style(font_size)
+
+        if frame.add(CountingParagraph(text, style), canvas):
+            return font_size
+
+        font_size = font_size * 0.95
+
+    return None
+
+
+def bench_plain_fit(count=1000):
+    rng = random.Random(1234)
+    words = (
+            'zip ties screws M3 M4 washers nuts spare fuses 5A 10A cable '
+            'HDMI USB-C adapter batteries AA AAA 18650 charger solder flux '
+            'wick heatshrink'
+            ).split()
+    texts = [
+            ' '.join(rng.choice(words) for i in range(rng.randint(1, 12)))
+            for i in range(count)
+            ]
+
+    # The text area of a cell of the default sheet.
+    size = labelsheet.templates['letter-2x6'].content_size
+
+    canvas = Canvas(io.BytesIO())
+
+    def legacy():
+        return [legacy_plain_fit(text, canvas, size) for text in texts]
+
+    def solver():
+        return [labelsheet.fit_paragraph(text, size)[0] for text in texts]
+
+    plain_paragraph = labelsheet.Paragraph
+    labelsheet.Paragraph = CountingParagraph
+
+    try:
+        print('{:8} {:>8}  {:>9}  {:>9}'.format('fit', 'labels', 'layouts', 'ms'))
+
+        for name, fit in (('legacy', legacy), ('solver', solver)):
+            CountingParagraph.wraps = 0
+            fit()
+            layouts = CountingParagraph.wraps
+
+            elapsed, _ = timed(fit, repeat=3)
+
+            print('{:8} {:8}  {:9}  {:9.2f}'.format(
+                name,
+                len(texts),
+                layouts,
+                elapsed * 1000,
+                ))
+    finally:
+        labelsheet.Paragraph = plain_paragraph
+
+
+benchmarks = {
+        'font-fit': bench_font_fit,
+        'inventory-lookup': bench_inventory_lookup,
+        'preview-formats': bench_preview_formats,
+        'parallel-pdf': bench_parallel_pdf,
+        'plain-fit': bench_plain_fit,
+        'qr-copies': bench_qr_copies,
+        'qr-pdf': bench_qr_pdf,
+        'raster': bench_raster,
+        'text-search': bench_text_search,
+        }
+
+
+if __name__ == '__main__':
+    names = sys.argv[1:] or sorted(benchmarks)
+
+    for name in names:
+        print('==', name, '==')
+        benchmarks[name]()
+        print()
@@ -0,0 +1,9 @@
+#!/usr/bin/fish
+
+
+function fake_lp
+    echo lp $argv >&2
+end
+
+
+fake_lp $argv
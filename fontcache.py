@@ -0,0 +1,86 @@
+#!/usr/bin/python3
+
+import collections
+import sys
+import threading
+
+import PIL.ImageFont
+
+
+class FontCache(object):
+    """
+    Process-wide store of TrueType fonts.
+
+    Family names are resolved to a file path once, instead of searching the
+    font directories on every lookup. Created FreeTypeFont objects are kept
+    in a bounded LRU keyed by (family, size); only a miss opens the file.
+    """
+
+    def __init__(self, families=(), maxsize=128):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+
+        self._paths = {}
+        self._fonts = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+        for family in families:
+            self.resolve(family)
+
+
+    def resolve(self, family):
+        with self._lock:
+            return self._resolve(family)
+
+
+    def _resolve(self, family):
+        try:
+            return self._paths[family]
+        except KeyError:
+            pass
+
+        path = PIL.ImageFont.truetype(family).path
+        self._paths[family] = path
+        return path
+
+
+    def get(self, family, size):
+        key = (family, size)
+
+        with self._lock:
+            try:
+                font = self._fonts[key]
+            except KeyError:
+                pass
+            else:
+                self._fonts.move_to_end(key)
+                self.hits += 1
+                return font
+
+            self.misses += 1
+
+            font = PIL.ImageFont.truetype(self._resolve(family), size=size)
+
+            self._fonts[key] = font
+            if len(self._fonts) > self.maxsize:
+                self._fonts.popitem(last=False)
+
+            return font
+
+
+    def stats(self):
+        with self._lock:
+            return dict(
+                    hits=self.hits,
+                    misses=self.misses,
+                    fonts=len(self._fonts),
+                    families=len(self._paths),
+                    )
+
+
+if __name__ == '__main__':
+    cache = FontCache()
+
+    for family in sys.argv[1:]:
+        print(family, cache.resolve(family))
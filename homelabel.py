@@ -1,40 +1,149 @@
 #!/usr/bin/python3
 
+import collections
+import concurrent.futures
+import functools
+import hashlib
 import itertools
+import PIL.Image
 import qrcode
 import reportlab
 import sys
-import tempfile
 
 import counter
+import labelsheet
 
 
-from reportlab.pdfgen.canvas import Canvas
-from reportlab.lib.pagesizes import letter
-from reportlab.lib.styles import ParagraphStyle
+from reportlab.lib.colors import HexColor, white
 from reportlab.lib.units import mm
-from reportlab.platypus import Paragraph, Frame, Image
+from reportlab.lib.utils import ImageReader
 
 
-def make_qr_image(data):
+@functools.lru_cache(maxsize=1024)
+def make_qr_matrix(data):
     QR = qrcode.QRCode(
             error_correction=qrcode.ERROR_CORRECT_M,
-            box_size=10,
             border=0,
             )
 
     QR.add_data(data)
     QR.make(fit=True)
-    return QR.make_image(back_color='#202020', fill_color='white')
+    return tuple(tuple(row) for row in QR.get_matrix())
+
+
+def qr_rectangles(matrix):
+    """
+    Coalesce the set modules of a QR matrix into rectangles.
+
+    Each row is split into horizontal runs, and a run continues the
+    rectangle above it when the previous row had exactly the same run.
+    Yields (x, y, width, height) in modules, with y counted from the top.
+    """
+    open_runs = {}
+
+    for y, row in enumerate(itertools.chain(matrix, [[]])):
+        runs = set()
+        start = None
+
+        for x, module in enumerate(itertools.chain(row, [False])):
+            if module and start is None:
+                start = x
+            elif not module and start is not None:
+                runs.add((start, x))
+                start = None
+
+        for run in list(open_runs):
+            if run not in runs:
+                top = open_runs.pop(run)
+                yield (run[0], top, run[1] - run[0], y - top)
+
+        for run in runs:
+            open_runs.setdefault(run, y)
+
+
+def draw_qr(canvas, matrix, x, y, size):
+    """
+    Draw a QR matrix as vector graphics in the colors of matrix_image: one
+    background square and a single path holding all module rectangles.
+
+    The drawing is registered once per document as a form XObject named
+    after the matrix, so further copies of the same code are references
+    to it rather than repeated paths.
+    """
+    modules = len(matrix)
+    digest = hashlib.md5(bytes(itertools.chain.from_iterable(matrix)))
+    name = 'qr{:}_{:}'.format(modules, digest.hexdigest())
+
+    if not canvas.hasForm(name):
+        canvas.beginForm(name, 0, 0, modules, modules)
+
+        canvas.setFillColor(HexColor('#202020'))
+        canvas.rect(0, 0, modules, modules, stroke=0, fill=1)
+
+        path = canvas.beginPath()
+        for rx, ry, rwidth, rheight in qr_rectangles(matrix):
+            path.rect(rx, modules - (ry + rheight), rwidth, rheight)
+
+        canvas.setFillColor(white)
+        canvas.drawPath(path, stroke=0, fill=1)
+
+        canvas.endForm()
+
+    canvas.saveState()
+
+    canvas.translate(x, y)
+    canvas.scale(size / modules, size / modules)
+    canvas.doForm(name)
+
+    canvas.restoreState()
+
+
+def matrix_image(matrix, box_size=10):
+    """
+    A QR matrix as an RGB image of box_size pixels per module, white
+    modules on a #202020 background.
+    """
+    modules = len(matrix)
+
+    image = PIL.Image.new('L', (modules, modules))
+    image.putdata([
+        255 if module else 0x20
+        for row in matrix
+        for module in row
+        ])
+
+    image = image.resize(
+            (modules * box_size, modules * box_size),
+            PIL.Image.NEAREST,
+            )
+
+    return image.convert('RGB')
+
+
+def render_qr(data, vector_qr=False):
+    """
+    The QR for data in the form draw_label takes it: the module matrix for
+    vector output, the PIL image otherwise. Top-level so worker processes
+    can run it. Only the matrix is memoized, so repeated payloads are
+    encoded once per process without keeping the images around.
+    """
+    matrix = make_qr_matrix(data)
+
+    if vector_qr:
+        return matrix
+
+    return matrix_image(matrix)
 
 
 class Label(object):
     def __init__(self, name, add_serial=True):
         self.name = name
+        self.serial = None
 
         if add_serial:
             C = counter.NotThreadSafeCounter('counter.txt')
-            self.name += '{:03}'.format(C.inc())
+            self.serial = '{:03}'.format(C.inc())
+            self.name += self.serial
 
     def __str__(self):
         return self.name
@@ -47,75 +156,100 @@ class Label(object):
             ))
 
 
-class LabelPage(object):
-    def __init__(self, labels=None):
-        if labels:
-            self.labels = list(labels)
-        else:
-            self.labels = []
+class LabelPage(labelsheet.LabelPage):
+    def __init__(self, labels=None, vector_qr=False, workers=None,
+            template='letter-2x6'):
+        super(LabelPage, self).__init__(labels, template)
 
+        self.vector_qr = vector_qr
+        self.workers = workers
 
-    def make_page(self, filename):
-        canvas = Canvas(filename, pagesize=letter)
-        label_section_size = (208 * mm, 254 * mm)
-        cols = 2
-        rows = 6
-
-        margin_x, margin_y = (
-                (full - printable) / 2
-                for full, printable in zip(letter, label_section_size)
-                )
 
-        pitch_x, pitch_y = (
-                printable / count
-                for printable, count in zip(label_section_size, (cols, rows))
-                )
+    def labels_with_qr(self, executor=None, window=48):
+        """
+        Yield (label, qr) pairs in input order.
 
-        canvas.saveState()
+        With an executor the QR matrices are encoded there, once per
+        distinct payload, keeping at most window labels in flight so the
+        input is still consumed lazily. Raster images are built from them
+        here, which is cheap next to sending them back. Without one, qr is
+        None and draw_label encodes it itself.
+        """
+        if executor is None:
+            for label in self.labels:
+                yield label, None
+            return
 
-        canvas.translate(margin_x, margin_y)
+        pending = collections.deque()
+        matrices = {}
 
-        iter_labels = iter(self.labels)
+        def result(future):
+            matrix = future.result()
+            return matrix if self.vector_qr else matrix_image(matrix)
 
-        for xindex, yindex in itertools.product(range(cols), range(rows)):
-            try:
-                label = next(iter_labels)
-            except StopIteration:
-                break
+        for label in self.labels:
+            data = label.qr_data()
 
-            canvas.saveState()
+            if data not in matrices:
+                if len(matrices) >= 1024:
+                    matrices.clear()
+                matrices[data] = executor.submit(make_qr_matrix, data)
 
-            canvas.translate(pitch_x * xindex, pitch_y * (rows - yindex - 1))
+            pending.append((label, matrices[data]))
 
-            LabelPage.draw_label(label, canvas, (pitch_x, pitch_y))
+            if len(pending) >= window:
+                label, future = pending.popleft()
+                yield label, result(future)
 
-            canvas.restoreState()
+        while pending:
+            label, future = pending.popleft()
+            yield label, result(future)
 
 
-        canvas.restoreState()
+    def make_page(self, filename):
+        if not self.workers:
+            return self.make_sheets(
+                    filename,
+                    self.labels_with_qr(),
+                    self.draw_cell,
+                    )
 
-        canvas.save()
+        with concurrent.futures.ProcessPoolExecutor(self.workers) as executor:
+            return self.make_sheets(
+                    filename,
+                    self.labels_with_qr(executor),
+                    self.draw_cell,
+                    )
 
 
-    @staticmethod
-    def draw_label(label, canvas, size):
-        width, height = size
+    def draw_cell(self, label_with_qr, canvas, size):
+        label, qr = label_with_qr
 
-        margin_x = 8 * mm
-        margin_y = 6 * mm
+        LabelPage.draw_label(
+                label,
+                canvas,
+                size,
+                vector_qr=self.vector_qr,
+                qr=qr,
+                )
 
-        canvas.translate(margin_x, margin_y)
 
-        width -= margin_x * 2
-        height -= margin_y * 2
+    @staticmethod
+    def draw_label(label, canvas, size, vector_qr=False, qr=None):
+        width, height = size
 
         qr_size = height
-        qr_image = make_qr_image(label.qr_data())
-        with tempfile.NamedTemporaryFile(suffix='.png') as F:
-            qr_image.save(F.name)
 
+        if qr is None:
+            qr = render_qr(label.qr_data(), vector_qr)
+
+        if vector_qr:
+            draw_qr(canvas, qr, width - qr_size, 0, qr_size)
+        else:
+            # Hand the decoded pixels straight to reportlab rather than
+            # writing a PNG for it to read back.
             canvas.drawImage(
-                    F.name,
+                    ImageReader(qr),
                     width - qr_size,
                     0,
                     width=qr_size,
@@ -123,37 +257,30 @@ class LabelPage(object):
                     )
 
         spacing = 6 * mm
-        frame_size = (width - qr_size - spacing, height)
-
-        frame = Frame(
-                0,
-                0,
-                *frame_size,
-                leftPadding=0,
-                bottomPadding=0,
-                rightPadding=0,
-                topPadding=0,
-                )
 
-        style = ParagraphStyle(
-                'name',
-                fontName='Courier-Bold',
-                fontSize=32,
-                leading=32,
-                textColor=(0.2, 0.2, 0.2),
+        labelsheet.draw_text(
+                canvas,
+                str(label),
+                (width - qr_size - spacing, height),
+                text_color=(0.2, 0.2, 0.2),
                 )
 
-        frame.add(Paragraph(str(label), style), canvas)
-
 
 if __name__ == '__main__':
-    filename = sys.argv[1]
+    # homelabel.py [--vector-qr] [--workers=N] [--template=NAME] FILE LABEL
+    try:
+        options, args = labelsheet.parse_options(sys.argv[1:], {
+            'vector-qr': None,
+            'workers': int,
+            'template': labelsheet.get_template,
+            })
+    except ValueError as e:
+        sys.exit('homelabel.py: {:}'.format(e))
 
-    labels = []
+    filename = args[0]
 
-    for label in sys.argv[2:]:
-        labels.append(Label(label))
+    labels = (Label(label) for label in args[1:])
 
-    page = LabelPage(labels)
+    page = LabelPage(labels, **options)
 
     page.make_page(filename)
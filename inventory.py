@@ -1,55 +1,1001 @@
 #!/usr/bin/python3
 
+import collections
+import concurrent.futures
+import contextlib
 import fcntl
+import json
+import mmap
+import os
+import os.path
+import queue
+import struct
 import sys
+import threading
+import time
+import traceback
+import zlib
 
+import sqliteconn
+import textindex
 
-class Inventory(object):
-    def __init__(self, filename):
-        self.filename = filename
 
+InventoryEntry = collections.namedtuple(
+        'InventoryEntry',
+        ('path', 'category', 'title', 'subtitle', 'serial'),
+        )
+
+
+@contextlib.contextmanager
+def locked(filename, mode, operation, timeout=None):
+    """
+    Open filename and flock() it, waiting up to timeout seconds for the
+    lock; without a timeout, BlockingIOError is raised right away.
+    """
+    with open(filename, mode) as F:
+        # flock() itself cannot time out, so a bounded wait polls with a
+        # growing interval.
+        deadline = time.monotonic() + (timeout or 0)
+        interval = 0.001
+
+        while True:
+            try:
+                fcntl.flock(F, operation | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                if time.monotonic() + interval > deadline:
+                    raise
 
-    def append(self, val):
-        with open(self.filename, 'a') as F:
-            fcntl.flock(F, fcntl.LOCK_EX | fcntl.LOCK_NB)
-            print(val, file=F)
+            time.sleep(interval)
+            interval = min(interval * 2, 0.05)
+
+        try:
+            yield F
+        finally:
             fcntl.flock(F, fcntl.LOCK_UN)
 
 
+class GroupCommit(object):
+    """
+    Batched appends for the inventory stores, which implement
+    _append_many(vals, timeout).
+    """
+
+    # Seconds the flusher waits for the store's lock before failing a
+    # batch.
+    lock_timeout = 5
+
+    def __init__(self, text_index=None):
+        self.text_index = text_index
+
+        self._pending = queue.Queue()
+        self._flusher = None
+        self._flusher_lock = threading.Lock()
+
+
+    def append(self, val, timeout=None):
+        self.append_many([val], timeout=timeout)
+
+
+    def append_many(self, vals, timeout=None):
+        """
+        Store all of vals in one batch, waiting up to timeout seconds for
+        the store's lock, and index them.
+        """
+        vals = list(vals)
+
+        self._append_many(vals, timeout)
+        self._index(vals)
+
+
+    def _index(self, vals):
+        if self.text_index is None:
+            return
+
+        paths = [
+                val.path if isinstance(val, InventoryEntry) else str(val)
+                for val in vals
+                ]
+
+        # The entries are stored already; a search index that falls behind
+        # can be rebuilt, so its errors do not fail the append.
+        try:
+            self.text_index.add_paths(paths)
+        except Exception:
+            traceback.print_exc()
+
+
+    def append_async(self, val):
+        """
+        Queue val for the background flusher and return a Future that is
+        resolved once it is stored, or fails with the error of its
+        batch, such as BlockingIOError when the lock was not free within
+        lock_timeout.
+        """
+        future = concurrent.futures.Future()
+
+        with self._flusher_lock:
+            self._pending.put((val, future))
+
+            if self._flusher is None:
+                self._flusher = threading.Thread(
+                        target=self._flush_loop,
+                        daemon=True,
+                        )
+                self._flusher.start()
+
+        return future
+
+
+    def _flush_loop(self):
+        while True:
+            batch = [self._pending.get()]
+
+            # Whatever queued up while the last batch was written goes into
+            # this one.
+            while True:
+                try:
+                    batch.append(self._pending.get_nowait())
+                except queue.Empty:
+                    break
+
+            entries = [entry for entry in batch if entry is not None]
+
+            if entries:
+                vals = [val for val, future in entries]
+
+                try:
+                    self._append_many(vals, self.lock_timeout)
+                except Exception as e:
+                    for val, future in entries:
+                        future.set_exception(e)
+                else:
+                    for val, future in entries:
+                        future.set_result(None)
+
+                    self._index(vals)
+
+            if len(entries) < len(batch):
+                return
+
+
+    def close(self):
+        """
+        Write out everything queued by append_async and stop the flusher.
+        """
+        with self._flusher_lock:
+            flusher, self._flusher = self._flusher, None
+
+            if flusher:
+                self._pending.put(None)
+
+        if flusher:
+            flusher.join()
+
+
+class Inventory(GroupCommit):
+    """
+    Append-only log of inventory entries, one per non-blank line, with a
+    sidecar index (filename + '.idx') of the entry offsets.
+    """
+
+    # count, covered bytes, inode, mtime_ns, CRC of the covered tail
+    header = struct.Struct('<QQQQQ')
+    offset = struct.Struct('<Q')
+
+    # How many of the last covered bytes the checksum is taken over.
+    checksum_size = 4096
+
+    def __init__(self, filename, text_index=None):
+        super(Inventory, self).__init__(text_index)
+
+        self.filename = filename
+        self.index_filename = filename + '.idx'
+
+
+    def _locked(self, mode, operation, timeout=None):
+        return locked(self.filename, mode, operation, timeout)
+
+
+    def _append_many(self, vals, timeout):
+        """
+        Append all of vals with one write under one lock acquisition.
+        """
+        data = ''.join(str(val) + '\n' for val in vals).encode('utf-8')
+
+        with self._locked('a+b', fcntl.LOCK_EX, timeout) as F:
+            # Do not run on into an unterminated last line.
+            size = os.fstat(F.fileno()).st_size
+            if size and os.pread(F.fileno(), 1, size - 1) != b'\n':
+                data = b'\n' + data
+
+            F.write(data)
+            F.flush()
+
+            self._sync_index(F)
+
+
+    @staticmethod
+    def _scan(F, start, end):
+        """
+        Offsets of the non-blank lines of F between start and end, and the
+        position after the last complete line.
+        """
+        offsets = []
+
+        if start >= end:
+            return offsets, start
+
+        with mmap.mmap(F.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            position = start
+
+            while True:
+                newline = data.find(b'\n', position, end)
+                if newline < 0:
+                    break
+
+                if data[position:newline].strip():
+                    offsets.append(position)
+
+                position = newline + 1
+
+        return offsets, position
+
+
+    def _checksum(self, F, end):
+        start = max(0, end - self.checksum_size)
+        return zlib.crc32(os.pread(F.fileno(), end - start, start))
+
+
+    def _sync_index(self, F):
+        """
+        Bring the index up to date with the locked log F. Returns the
+        number of indexed entries and the offset of the unterminated last
+        entry, or None if there is none.
+        """
+        stat = os.fstat(F.fileno())
+        size = stat.st_size
+
+        fd = os.open(self.index_filename, os.O_RDWR | os.O_CREAT, 0o644)
+
+        with open(fd, 'r+b') as I:
+            fcntl.flock(I, fcntl.LOCK_EX)
+
+            header = I.read(self.header.size)
+            if len(header) == self.header.size:
+                count, indexed, inode, mtime, checksum = \
+                        self.header.unpack(header)
+            else:
+                count, indexed, inode, mtime, checksum = 0, 0, 0, 0, 0
+
+            expected_size = self.header.size + count * self.offset.size
+
+            if (
+                    inode != stat.st_ino
+                    or indexed > size
+                    or os.fstat(fd).st_size < expected_size
+                    ):
+                count, indexed = 0, 0
+            elif mtime != stat.st_mtime_ns or indexed < size:
+                # Changed since the last sync: appended to, or rewritten.
+                # The mtime may not have moved for a write within the same
+                # clock tick, so the size alone also triggers the check.
+                if self._checksum(F, indexed) != checksum:
+                    count, indexed = 0, 0
+
+            if indexed < size or mtime != stat.st_mtime_ns or not count:
+                offsets, indexed = self._scan(F, indexed, size)
+
+                I.seek(self.header.size + count * self.offset.size)
+                I.write(struct.pack('<{:}Q'.format(len(offsets)), *offsets))
+                I.truncate()
+
+                count += len(offsets)
+
+                I.seek(0)
+                I.write(self.header.pack(
+                    count,
+                    indexed,
+                    stat.st_ino,
+                    stat.st_mtime_ns,
+                    self._checksum(F, indexed),
+                    ))
+
+        # A last line without its newline is never indexed.
+        if os.pread(F.fileno(), size - indexed, indexed).strip():
+            return count, indexed
+
+        return count, None
+
+
+    def _offset(self, position):
+        with open(self.index_filename, 'rb') as I:
+            fcntl.flock(I, fcntl.LOCK_SH)
+
+            I.seek(self.header.size + position * self.offset.size)
+            offset, = self.offset.unpack(I.read(self.offset.size))
+
+            return offset
+
+
     def __len__(self):
-        lines = 0
-
-        with open(self.filename, 'r') as F:
-            fcntl.flock(F, fcntl.LOCK_EX | fcntl.LOCK_NB)
-            for line in F:
-                line = line.strip()
-                if line:
-                    lines += 1
-            fcntl.flock(F, fcntl.LOCK_UN)
+        with self._locked('rb', fcntl.LOCK_SH) as F:
+            count, tail = self._sync_index(F)
+            return count if tail is None else count + 1
+
+
+    def __getitem__(self, position):
+        with self._locked('rb', fcntl.LOCK_SH) as F:
+            count, tail = self._sync_index(F)
+            total = count if tail is None else count + 1
+
+            if position < 0:
+                position += total
+            if not 0 <= position < total:
+                raise IndexError('inventory entry out of range')
 
-        return lines
+            if position == count:
+                F.seek(tail)
+            else:
+                F.seek(self._offset(position))
+
+            return F.readline().decode('utf-8').strip()
 
 
     def contents(self):
-        with open(self.filename, 'r') as F:
-            fcntl.flock(F, fcntl.LOCK_EX | fcntl.LOCK_NB)
-            ret = list(
-                    filter(
-                        None,
-                        (line.strip() for line in F)
-                        )
+        """
+        Generate the entries in order. The log is mapped rather than read,
+        and stays share-locked until the generator is exhausted or closed.
+        """
+        with self._locked('rb', fcntl.LOCK_SH) as F:
+            size = os.fstat(F.fileno()).st_size
+
+            if not size:
+                return
+
+            with mmap.mmap(F.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                position = 0
+
+                while position < size:
+                    newline = data.find(b'\n', position)
+                    if newline < 0:
+                        newline = size
+
+                    line = data[position:newline].strip()
+                    if line:
+                        yield line.decode('utf-8')
+
+                    position = newline + 1
+
+
+class SegmentedInventory(GroupCommit):
+    """
+    Inventory stored in a directory as a manifest of log segments of about
+    segment_size bytes, compacted in the background.
+    """
+
+    segment_size = 1024 * 1024
+    compact_segments = 8
+
+    def __init__(self, directory, text_index=None):
+        super(SegmentedInventory, self).__init__(text_index)
+
+        self.directory = directory
+        self.manifest_filename = os.path.join(directory, 'MANIFEST')
+        self.lock_filename = os.path.join(directory, 'LOCK')
+
+        self._compactor = None
+        self._compactor_lock = threading.Lock()
+
+        os.makedirs(directory, exist_ok=True)
+
+        with self._locked(fcntl.LOCK_EX, self.lock_timeout):
+            if not os.path.exists(self.manifest_filename):
+                self._write_manifest(dict(
+                    next_id=2,
+                    segments=[dict(id=1, last=1, sealed=False)],
+                    ))
+
+
+    def _locked(self, operation, timeout=None):
+        # The background compaction takes the lock too, so callers that
+        # give no timeout wait lock_timeout rather than fail at once.
+        if timeout is None:
+            timeout = self.lock_timeout
+
+        return locked(self.lock_filename, 'a', operation, timeout)
+
+
+    def _read_manifest(self):
+        with open(self.manifest_filename, 'r') as F:
+            return json.load(F)
+
+
+    def _write_manifest(self, manifest):
+        # Readers see either the old or the new manifest, never a part.
+        temporary = self.manifest_filename + '.tmp'
+
+        with open(temporary, 'w') as F:
+            json.dump(manifest, F, indent=1)
+            F.flush()
+            os.fsync(F.fileno())
+
+        os.replace(temporary, self.manifest_filename)
+
+
+    def _segment_filename(self, segment):
+        return os.path.join(
+                self.directory,
+                'segment-{:08}.log'.format(segment['id']),
+                )
+
+
+    def _segment(self, segment):
+        return Inventory(self._segment_filename(segment))
+
+
+    def _append_many(self, vals, timeout):
+        """
+        Append all of vals to the active segment under one lock
+        acquisition, and start a new segment if it has grown too large.
+        """
+        with self._locked(fcntl.LOCK_EX, timeout):
+            manifest = self._read_manifest()
+            active = manifest['segments'][-1]
+
+            self._segment(active).append_many(vals)
+
+            size = os.path.getsize(self._segment_filename(active))
+            if size >= self.segment_size:
+                self._rotate(manifest)
+
+            uncompacted = len(self._uncompacted(manifest))
+
+        if uncompacted >= self.compact_segments:
+            self.compact_async()
+
+
+    def _compacted(self, manifest):
+        """
+        The leading segments that are the output of earlier compactions.
+        """
+        segments = []
+
+        for segment in manifest['segments']:
+            if not segment.get('compacted'):
+                break
+            segments.append(segment)
+
+        return segments
+
+
+    def _uncompacted(self, manifest):
+        """
+        The sealed segments after the compacted ones, which the next
+        compaction merges.
+        """
+        segments = []
+
+        for segment in manifest['segments'][len(self._compacted(manifest)):]:
+            if not segment['sealed']:
+                break
+            segments.append(segment)
+
+        return segments
+
+
+    def _rotate(self, manifest):
+        active = manifest['segments'][-1]
+
+        if not os.path.exists(self._segment_filename(active)):
+            return False
+
+        active['sealed'] = True
+        segment_id = manifest['next_id']
+        manifest['segments'].append(dict(
+            id=segment_id,
+            last=segment_id,
+            sealed=False,
+            ))
+        manifest['next_id'] += 1
+
+        self._write_manifest(manifest)
+
+        return True
+
+
+    def rotate(self, timeout=None):
+        """
+        Seal the active segment now, unless it is still empty, so that
+        since() returns its entries.
+        """
+        with self._locked(fcntl.LOCK_EX, timeout):
+            return self._rotate(self._read_manifest())
+
+
+    def checkpoint(self):
+        """
+        The id up to which since() has returned everything that is sealed.
+        """
+        with self._locked(fcntl.LOCK_SH):
+            manifest = self._read_manifest()
+
+        return max(
+                (segment['last'] for segment in manifest['segments']
+                    if segment['sealed']),
+                default=0,
+                )
+
+
+    def since(self, checkpoint=0):
+        """
+        Return (new_checkpoint, entries), where entries generates the
+        entries of every sealed segment newer than checkpoint. The segment
+        files are opened right away, so a later compaction cannot take them
+        away.
+        """
+        files = []
+        new_checkpoint = checkpoint
+
+        with self._locked(fcntl.LOCK_SH):
+            manifest = self._read_manifest()
+
+            for segment in manifest['segments']:
+                if segment['sealed'] and segment['last'] > checkpoint:
+                    files.append(open(self._segment_filename(segment), 'rb'))
+                    new_checkpoint = max(new_checkpoint, segment['last'])
+
+        def entries():
+            for F in files:
+                with F:
+                    for line in F:
+                        line = line.strip()
+                        if line:
+                            yield line.decode('utf-8')
+
+        return new_checkpoint, entries()
+
+
+    def _segments(self):
+        manifest = self._read_manifest()
+
+        return [
+                self._segment(segment)
+                for segment in manifest['segments']
+                if os.path.exists(self._segment_filename(segment))
+                ]
+
+
+    def __len__(self):
+        with self._locked(fcntl.LOCK_SH):
+            return sum(len(segment) for segment in self._segments())
+
+
+    def __getitem__(self, position):
+        with self._locked(fcntl.LOCK_SH):
+            segments = self._segments()
+            counts = [len(segment) for segment in segments]
+
+            if position < 0:
+                position += sum(counts)
+            if position < 0:
+                raise IndexError('inventory entry out of range')
+
+            for segment, count in zip(segments, counts):
+                if position < count:
+                    return segment[position]
+                position -= count
+
+        raise IndexError('inventory entry out of range')
+
+
+    def contents(self):
+        """
+        Generate all entries, oldest segment first. The manifest stays
+        share-locked until the generator is exhausted or closed.
+        """
+        with self._locked(fcntl.LOCK_SH):
+            for segment in self._segments():
+                yield from segment.contents()
+
+
+    def compact(self, timeout=None):
+        """
+        Merge the sealed segments written since the last compaction into as
+        few segments of segment_size as possible, keeping only the first
+        occurrence of every entry. Segments compacted before are only read,
+        to find the duplicates.
+
+        The merge is written without holding the lock; it is only taken,
+        waiting up to timeout seconds, to swap the new segments into the
+        manifest. Returns the number of duplicate entries dropped.
+        """
+        with self._locked(fcntl.LOCK_SH, timeout):
+            manifest = self._read_manifest()
+
+            previous = self._compacted(manifest)
+            sources = self._uncompacted(manifest)
+
+            if not sources:
+                return 0
+
+            files = [
+                    open(self._segment_filename(segment), 'rb')
+                    for segment in previous + sources
+                    ]
+
+        outputs = []
+        seen = set()
+        duplicates = 0
+        output = None
+
+        try:
+            for F in files[:len(previous)]:
+                with F:
+                    for line in F:
+                        entry = line.strip()
+                        if entry:
+                            seen.add(entry)
+
+            files = files[len(previous):]
+
+            for segment, F in zip(sources, files):
+                with F:
+                    for line in F:
+                        entry = line.strip()
+                        if not entry:
+                            continue
+
+                        if entry in seen:
+                            duplicates += 1
+                            continue
+                        seen.add(entry)
+
+                        if output and output.tell() >= self.segment_size:
+                            output.close()
+                            output = None
+
+                        if output is None:
+                            temporary = os.path.join(
+                                    self.directory,
+                                    'compact-{:}-{:}.tmp'.format(
+                                        os.getpid(),
+                                        len(outputs),
+                                        ),
+                                    )
+                            output = open(temporary, 'wb')
+                            outputs.append([temporary, segment['last']])
+
+                        output.write(entry + b'\n')
+                        outputs[-1][1] = segment['last']
+
+            if output is not None:
+                output.close()
+
+            # Index the new segments now rather than on their first read.
+            for temporary, last in outputs:
+                len(Inventory(temporary))
+
+            with self._locked(fcntl.LOCK_EX, timeout):
+                manifest = self._read_manifest()
+                segments = manifest['segments']
+
+                # Someone else compacted in the meantime.
+                merged = len(previous) + len(sources)
+                if segments[:merged] != previous + sources:
+                    return 0
+
+                compacted = []
+                for temporary, last in outputs:
+                    segment = dict(
+                            id=manifest['next_id'],
+                            last=last,
+                            sealed=True,
+                            compacted=True,
+                            )
+                    manifest['next_id'] += 1
+
+                    filename = self._segment_filename(segment)
+                    os.replace(temporary + '.idx', filename + '.idx')
+                    os.replace(temporary, filename)
+                    compacted.append(segment)
+
+                manifest['segments'] = previous + compacted + segments[merged:]
+                self._write_manifest(manifest)
+                outputs = []
+
+                for segment in sources:
+                    filename = self._segment_filename(segment)
+                    for name in (filename, filename + '.idx'):
+                        if os.path.exists(name):
+                            os.remove(name)
+
+            return duplicates
+        finally:
+            for temporary, last in outputs:
+                for name in (temporary, temporary + '.idx'):
+                    if os.path.exists(name):
+                        os.remove(name)
+
+
+    def compact_async(self):
+        """
+        Start compact() on a background thread, unless one is running.
+        """
+        with self._compactor_lock:
+            if self._compactor and self._compactor.is_alive():
+                return
+
+            self._compactor = threading.Thread(
+                    target=self._compact_loop,
+                    daemon=True,
                     )
-            fcntl.flock(F, fcntl.LOCK_UN)
-        return ret
+            self._compactor.start()
+
+
+    def _compact_loop(self):
+        try:
+            self.compact(timeout=self.lock_timeout)
+        except Exception:
+            traceback.print_exc()
+
+
+    def close(self):
+        super(SegmentedInventory, self).close()
+
+        with self._compactor_lock:
+            compactor = self._compactor
+
+        if compactor:
+            compactor.join()
+
+
+def read_entry(path):
+    """
+    The InventoryEntry for a spooled file. Descriptions written by
+    labelcreator.inventory_label start with the category, title, subtitle
+    and serial number lines; fields that cannot be read or are blank are
+    None.
+    """
+    fields = [None, None, None, None]
+
+    if path.lower().endswith('.txt'):
+        try:
+            with open(path, 'r') as F:
+                for i in range(len(fields)):
+                    fields[i] = F.readline().strip() or None
+        except (OSError, UnicodeDecodeError):
+            pass
+
+    return InventoryEntry(path, *fields)
+
+
+class SqliteInventory(GroupCommit):
+    """
+    Inventory kept in an SQLite database, with the same interface as
+    Inventory and find() on the entry fields.
+    """
+
+    columns = InventoryEntry._fields
+
+    schema = (
+            """
+            CREATE TABLE IF NOT EXISTS entries (
+                id INTEGER PRIMARY KEY,
+                path TEXT NOT NULL,
+                category TEXT,
+                title TEXT,
+                subtitle TEXT,
+                serial TEXT
+                )
+            """,
+            'CREATE INDEX IF NOT EXISTS entries_path ON entries (path)',
+            """
+            CREATE INDEX IF NOT EXISTS entries_category_title
+                ON entries (category, title)
+            """,
+            'CREATE INDEX IF NOT EXISTS entries_title ON entries (title)',
+            """
+            CREATE INDEX IF NOT EXISTS entries_subtitle
+                ON entries (subtitle)
+            """,
+            'CREATE INDEX IF NOT EXISTS entries_serial ON entries (serial)',
+            )
+
+    def __init__(self, filename, text_index=None):
+        super(SqliteInventory, self).__init__(text_index)
+
+        self.filename = filename
+        self._connections = sqliteconn.ThreadConnections(
+                filename,
+                timeout=0,
+                )
+
+        with self._connection() as connection:
+            # Stores made while the serial column was missing get it back.
+            columns = [
+                    row[1] for row in
+                    connection.execute('PRAGMA table_info(entries)')
+                    ]
+            if columns and 'serial' not in columns:
+                connection.execute('ALTER TABLE entries ADD COLUMN serial TEXT')
+
+            for statement in self.schema:
+                connection.execute(statement)
+
+
+    def _connection(self):
+        return self._connections.get()
+
+
+    def _append_many(self, vals, timeout):
+        """
+        Insert all of vals in one transaction, waiting up to timeout
+        seconds for other writers.
+        """
+        entries = [
+                val if isinstance(val, InventoryEntry) else read_entry(str(val))
+                for val in vals
+                ]
+
+        connection = self._connection()
+        connection.execute('PRAGMA busy_timeout={:d}'.format(
+            int((timeout or 0) * 1000),
+            ))
+
+        with connection:
+            connection.executemany(
+                    'INSERT INTO entries ({:}) VALUES ({:})'.format(
+                        ', '.join(self.columns),
+                        ', '.join('?' * len(self.columns)),
+                        ),
+                    entries,
+                    )
+
+
+    def __len__(self):
+        cursor = self._connection().execute('SELECT count(*) FROM entries')
+        return cursor.fetchone()[0]
+
+
+    def __getitem__(self, position):
+        if position < 0:
+            position += len(self)
+        if position < 0:
+            raise IndexError('inventory entry out of range')
+
+        row = self._connection().execute(
+                'SELECT path FROM entries ORDER BY id LIMIT 1 OFFSET ?',
+                (position,),
+                ).fetchone()
+
+        if row is None:
+            raise IndexError('inventory entry out of range')
+
+        return row[0]
+
+
+    def contents(self):
+        cursor = self._connection().execute(
+                'SELECT path FROM entries ORDER BY id',
+                )
+
+        for path, in cursor:
+            yield path
+
+
+    def find(self, **fields):
+        """
+        The InventoryEntry values whose fields equal all of the given ones,
+        e.g. find(category='Animal', title='Llama'), in insertion order.
+        """
+        unknown = set(fields) - set(self.columns)
+        if unknown:
+            raise TypeError('unknown inventory fields: {:}'.format(
+                ', '.join(sorted(unknown)),
+                ))
+
+        query = 'SELECT {:} FROM entries'.format(', '.join(self.columns))
+        if fields:
+            query += ' WHERE ' + ' AND '.join(
+                    '{:} = ?'.format(field) for field in fields
+                    )
+        query += ' ORDER BY id'
+
+        cursor = self._connection().execute(query, tuple(fields.values()))
+
+        return [InventoryEntry(*row) for row in cursor]
+
+
+    def exists(self, **fields):
+        return bool(self.find(**fields))
+
+
+    def import_log(self, filename, batch_size=10000):
+        """
+        Copy every entry of the text log filename into the store, reading
+        the fields from the spooled files once. Returns the number of
+        entries imported.
+        """
+        imported = 0
+        batch = []
+
+        for path in Inventory(filename).contents():
+            batch.append(read_entry(path))
+
+            if len(batch) >= batch_size:
+                self.append_many(batch)
+                imported += len(batch)
+                batch = []
+
+        if batch:
+            self.append_many(batch)
+            imported += len(batch)
+
+        return imported
+
+
+    def close(self):
+        super(SqliteInventory, self).close()
+
+        self._connections.close()
+
+
+def load(filename, text_index=True):
+    """
+    The inventory store for filename: SQLite for .db and .sqlite files,
+    segments for directories and .d names, the text log otherwise. Unless
+    text_index is false, appended entries are also added to the full-text
+    index next to it.
+    """
+    if text_index:
+        text_index = textindex.TextIndex(textindex.index_filename(filename))
+    else:
+        text_index = None
+
+    if filename.lower().endswith(('.db', '.sqlite')):
+        return SqliteInventory(filename, text_index)
+
+    if filename.endswith('.d') or os.path.isdir(filename):
+        return SegmentedInventory(filename, text_index)
+
+    return Inventory(filename, text_index)
 
 
 if __name__ == '__main__':
+    if sys.argv[1] == '--import':
+        # inventory.py --import LOG DATABASE
+        log, database = sys.argv[2:4]
+        inv = load(database)
+        print(inv.import_log(log), 'entries imported')
+        inv.close()
+        sys.exit(0)
+
+    if sys.argv[1] == '--compact':
+        # inventory.py --compact DIRECTORY
+        duplicates = SegmentedInventory(sys.argv[2]).compact(timeout=5)
+        print(duplicates, 'duplicates removed')
+        sys.exit(0)
+
+    if sys.argv[1] == '--since':
+        # inventory.py --since CHECKPOINT DIRECTORY, printing the entries
+        # and then the new checkpoint on stderr.
+        inv = SegmentedInventory(sys.argv[3])
+        checkpoint, entries = inv.since(int(sys.argv[2]))
+        for line in entries:
+            print(line)
+        print(checkpoint, file=sys.stderr)
+        sys.exit(0)
+
     filename = sys.argv[1]
 
-    inv = Inventory(filename)
+    inv = load(filename)
 
     for val in sys.argv[2:]:
         inv.append(val)
 
     for line in inv.contents():
         print(line)
+
+    # Waits for a compaction the appends may have started.
+    inv.close()
@@ -0,0 +1,88 @@
+#!/usr/bin/python3
+
+import functools
+import importlib
+import os
+import os.path
+import re
+import sys
+
+import homelabel
+import plainlabel
+
+
+def escape(name):
+    return re.sub(r'[^a-zA-Z0-9_-]+', '_', name).lower()
+
+
+def inventory_label(category, title, subtitle, description, spool='spool',
+        add_serial=False):
+    """
+    In-process counterpart of fake_full_label.fish: writes the sticker PDF
+    and the description next to it and returns both paths. With
+    add_serial, the title gets the next serial number from counter.txt,
+    which the description records on the line after the subtitle.
+    """
+    if not category or not title:
+        raise ValueError('category and title must not be blank')
+
+    label = homelabel.Label(title, add_serial=add_serial)
+
+    filename = os.path.join(spool, escape(category), escape(str(label)))
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+
+    page = homelabel.LabelPage([label])
+    page.make_page(filename + '.pdf')
+
+    with open(filename + '.txt', 'w') as F:
+        print(category, label, subtitle, sep='\n', file=F)
+        if label.serial:
+            print(label.serial, file=F)
+        print(file=F)
+        print(description, file=F)
+
+    return [filename + '.pdf', filename + '.txt']
+
+
+def plain_label(text, spool='spool'):
+    """
+    In-process counterpart of fake_plain_label.fish.
+    """
+    if not text:
+        raise ValueError('text must not be blank')
+
+    filename = os.path.join(spool, 'plain', escape(text))
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+
+    plainlabel.LabelPage([text]).make_page(filename + '.pdf')
+
+    return [filename + '.pdf']
+
+
+def load(spec):
+    """
+    Resolve a creator given as 'module:function' to the function itself, or
+    'pool:module:function' to a function submitting to the shared worker
+    pool.
+
+    Anything else, including paths to existing files, is an executable to
+    run as a subprocess, for which None is returned.
+    """
+    if os.path.exists(spec) or ':' not in spec:
+        return None
+
+    if spec.startswith('pool:'):
+        import labelpool
+        return functools.partial(labelpool.shared_pool().submit, spec[5:])
+
+    module_name, function_name = spec.split(':', 1)
+    module = importlib.import_module(module_name)
+
+    return getattr(module, function_name)
+
+
+if __name__ == '__main__':
+    function = load(sys.argv[1])
+
+    for path in function(*sys.argv[2:]):
+        print(path)
@@ -1,27 +1,300 @@
 #!/usr/bin/python3
 
-import io
+import collections
+import os
 import os.path
-import subprocess
 import sys
+import traceback
 
 from PyQt5 import QtCore, QtGui, QtWidgets
 from PyQt5.QtCore import Qt
 from labelwindow import Ui_LabelerWindow
 
 import inventory
+import labelcreator
+import labelpool
 import labelpreview
+import printing
+import raster
+
+
+def image_to_qimage(image):
+    """
+    Wrap the raw pixels of an RGB PIL.Image in a QImage, without encoding.
+    """
+    width, height = image.size
+    data = image.tobytes('raw', 'RGB')
+
+    qimage = QtGui.QImage(
+            data,
+            width,
+            height,
+            width * 3,
+            QtGui.QImage.Format_RGB888,
+            )
+
+    # QImage does not own the buffer it was built over.
+    return qimage.copy()
+
+
+class PreviewSignals(QtCore.QObject):
+    rendered = QtCore.pyqtSignal(int, int, QtGui.QImage)
+
+
+class PreviewJob(QtCore.QRunnable):
+    """
+    Renders every preview format of one LabelPreview off the GUI thread.
+
+    Each finished image is posted back through signals.rendered together with
+    the job's generation. The job stops as soon as is_current() reports that
+    a newer request has superseded it.
+    """
+
+    def __init__(self, preview, formats, generation, is_current, signals):
+        super(PreviewJob, self).__init__()
+
+        self.preview = preview
+        self.formats = formats
+        self.generation = generation
+        self.is_current = is_current
+        self.signals = signals
+
+
+    def run(self):
+        for index, (size, subparts) in enumerate(self.formats):
+            if not self.is_current(self.generation):
+                return
+
+            image = labelpreview.previews.render(
+                    self.preview,
+                    size=size,
+                    subparts=subparts,
+                    )
+
+            if not image:
+                continue
+
+            self.signals.rendered.emit(
+                    self.generation,
+                    index,
+                    image_to_qimage(image),
+                    )
+
+
+class InventorySignals(QtCore.QObject):
+    saved = QtCore.pyqtSignal(object, str, object)
+
+
+class CreatorCallSignals(QtCore.QObject):
+    started = QtCore.pyqtSignal()
+    done = QtCore.pyqtSignal(list, int)
+
+
+class CreatorCall(QtCore.QRunnable):
+    """
+    Calls an in-process creator function on a worker thread and reports the
+    output paths it returned, or a non-zero return code if it raised.
+    """
+
+    def __init__(self, function, kwargs, signals):
+        super(CreatorCall, self).__init__()
+
+        self.function = function
+        self.kwargs = kwargs
+        self.signals = signals
+
+
+    def run(self):
+        self.signals.started.emit()
+
+        try:
+            paths = list(self.function(**self.kwargs))
+        except Exception:
+            traceback.print_exc()
+            self.signals.done.emit([], 1)
+        else:
+            self.signals.done.emit(paths, 0)
+
+
+class CreatorJob(QtCore.QObject):
+    """
+    One run of a label creator executable.
+
+    The creator runs in a QProcess so the window stays responsive; its
+    standard output is split into lines and emitted as they arrive, and
+    finished is emitted once the process has exited or was killed after
+    the timeout.
+
+    An in-process creator function runs on a thread of pool instead. A
+    thread cannot be killed, so after the timeout the job is failed and
+    whatever the call returns later is ignored.
+    """
+
+    line_received = QtCore.pyqtSignal(object, bytes)
+    finished = QtCore.pyqtSignal(object)
+
+    timeout = 60000
+
+    def __init__(self, kind, args, title, copies, function=None, kwargs=None,
+            pool=None, parent=None):
+        super(CreatorJob, self).__init__(parent)
+
+        self.kind = kind
+        self.args = args
+        self.function = function
+        self.kwargs = kwargs
+        self.pool = pool
+        self.title = title
+        self.copies = copies
+
+        self.returncode = None
+        self.error = None
+        self.print_filename = None
+        self.preview = None
+        self.subparts = 1
+        self.inventory_paths = []
+        self.inventory_pending = 0
+        self.item = None
+
+        self._buffer = b''
+
+        self.process = QtCore.QProcess(self)
+        self.process.readyReadStandardOutput.connect(self.read_output)
+        self.process.finished.connect(self.process_finished)
+        self.process.errorOccurred.connect(self.process_error)
+
+        self.timer = QtCore.QTimer(self, interval=self.timeout, singleShot=True)
+        self.timer.timeout.connect(self.timed_out)
+
+
+    def start(self):
+        if self.function:
+            # Not parented to the job, which may be deleted before a call
+            # that timed out returns.
+            signals = CreatorCallSignals()
+            signals.done.connect(self.call_finished)
+
+            # The timeout counts from when the call leaves the queue.
+            signals.started.connect(self.timer.start)
+
+            self.pool.start(CreatorCall(self.function, self.kwargs, signals))
+            return
+
+        self.process.start(self.args[0], self.args[1:])
+        self.timer.start()
+
+
+    @QtCore.pyqtSlot()
+    def timed_out(self):
+        if not self.function:
+            self.process.kill()
+            return
+
+        if self.returncode is None:
+            self.returncode = -1
+            self.finished.emit(self)
+
+
+    @QtCore.pyqtSlot(list, int)
+    def call_finished(self, paths, returncode):
+        self.timer.stop()
+
+        # Already failed by the timeout.
+        if self.returncode is not None:
+            return
+
+        for path in paths:
+            self.line_received.emit(self, os.fsencode(path))
+
+        self.returncode = returncode
+        self.finished.emit(self)
+
+
+    @QtCore.pyqtSlot()
+    def read_output(self):
+        self._buffer += bytes(self.process.readAllStandardOutput())
+
+        *lines, self._buffer = self._buffer.split(b'\n')
+
+        for line in lines:
+            if line:
+                self.line_received.emit(self, line)
+
+
+    @QtCore.pyqtSlot(int, QtCore.QProcess.ExitStatus)
+    def process_finished(self, exit_code, exit_status):
+        self.timer.stop()
+
+        self.read_output()
+        if self._buffer:
+            self.line_received.emit(self, self._buffer)
+            self._buffer = b''
+
+        if exit_status == QtCore.QProcess.NormalExit:
+            self.returncode = exit_code
+        else:
+            self.returncode = -1
+
+        self.finished.emit(self)
+
+
+    @QtCore.pyqtSlot(QtCore.QProcess.ProcessError)
+    def process_error(self, error):
+        # Crashes and timeouts are reported through process_finished.
+        if error == QtCore.QProcess.FailedToStart:
+            self.timer.stop()
+            self.returncode = -1
+            self.finished.emit(self)
 
 
 class LabelerWindow(QtWidgets.QMainWindow, Ui_LabelerWindow):
     _placeholder_style = "color: gray; font-style: italic"
 
+    max_job_items = 50
+
+    lp_command = ('echo', 'lp')
+
     def __init__(self, creators, inventory_file, printer, parent=None):
         super(LabelerWindow, self).__init__(parent)
 
-        self.inventory = inventory.Inventory(inventory_file)
+        self.inventory = inventory.load(inventory_file)
+
+        # Appends are written by the inventory's flusher thread; their
+        # results come back to the GUI thread through this signal.
+        self.inventory_signals = InventorySignals()
+        self.inventory_signals.saved.connect(
+                self.inventory_saved,
+                Qt.QueuedConnection,
+                )
         self.creators = creators
-        self.printer = printer
+        self.creator_functions = {
+                kind: labelcreator.load(creator)
+                for kind, creator in creators.items()
+                }
+
+        # In-process creators run one at a time, off the GUI thread.
+        # 'pool:' creators only wait for a worker process, so as many run
+        # at once as the worker pool has processes.
+        self.creator_pool = QtCore.QThreadPool()
+        self.creator_pool.setMaxThreadCount(1)
+
+        self.worker_pool = QtCore.QThreadPool()
+        if any(creator.startswith('pool:') for creator in creators.values()):
+            size = labelpool.shared_pool().size
+            self.worker_pool.setMaxThreadCount(size)
+        self.printer = printing.LpPrinter(printer, command=self.lp_command)
+
+        # LABELER_RASTER=pwg or pbm sends the labels to the printer as
+        # raster images instead of the creators' PDFs.
+        raster_format = os.environ.get('LABELER_RASTER')
+        if raster_format:
+            self.raster_printer = printing.RasterPrinter(
+                    printer,
+                    command=self.lp_command,
+                    format=raster_format,
+                    )
+        else:
+            self.raster_printer = None
 
         self.setupUi(self)
 
@@ -53,10 +326,29 @@ class LabelerWindow(QtWidgets.QMainWindow, Ui_LabelerWindow):
 
 
         self._preview_cache = None
+        self._preview_generation = 0
 
-        self.timPreview = QtCore.QTimer(interval=300)
+        self.preview_signals = PreviewSignals()
+        self.preview_signals.rendered.connect(self.preview_rendered)
+
+        # A single render thread: queued jobs are dropped whenever a newer
+        # one is started, so at most one stale render is ever in flight.
+        self.preview_pool = QtCore.QThreadPool()
+        self.preview_pool.setMaxThreadCount(1)
+
+        # Previews are only rebuilt when an input changes; the single-shot
+        # timer coalesces a burst of keystrokes into one render request.
+        self.timPreview = QtCore.QTimer(interval=100, singleShot=True)
         self.timPreview.timeout.connect(self.update_preview)
-        self.timPreview.start()
+
+        self.leCategory.textChanged.connect(self.schedule_preview)
+        self.leTitle.textChanged.connect(self.schedule_preview)
+        self.leSubtitle.textChanged.connect(self.schedule_preview)
+        self.lePlainText.textChanged.connect(self.schedule_preview)
+        self.pbNamed.toggled.connect(self.schedule_preview)
+        self.pbSerial.toggled.connect(self.schedule_preview)
+
+        self.schedule_preview()
 
 
     @QtCore.pyqtSlot('QString')
@@ -139,6 +431,7 @@ class LabelerWindow(QtWidgets.QMainWindow, Ui_LabelerWindow):
         num_stickers = num_labels // per_sticker
 
         self.num_stickers = num_stickers
+        self.per_sticker = per_sticker
 
         label = 'label' if (num_labels == 1) else 'labels'
         sticker = 'sticker' if (num_stickers == 1) else 'stickers'
@@ -165,6 +458,11 @@ class LabelerWindow(QtWidgets.QMainWindow, Ui_LabelerWindow):
         return 'Plain' in self.tabs.tabText(self.tabs.currentIndex())
 
 
+    @QtCore.pyqtSlot()
+    def schedule_preview(self):
+        self.timPreview.start()
+
+
     @QtCore.pyqtSlot()
     def update_preview(self):
         if self.is_inventory():
@@ -193,25 +491,51 @@ class LabelerWindow(QtWidgets.QMainWindow, Ui_LabelerWindow):
         self._preview_cache = preview
 
 
-        for widget, per_sticker in (
+        self._preview_generation += 1
+
+        formats = []
+        for widget, per_sticker in self.preview_widgets():
+            icon_size = widget.iconSize()
+            size = (icon_size.width(), icon_size.height())
+            formats.append((size, per_sticker))
+
+        self.preview_pool.clear()
+        self.preview_pool.start(PreviewJob(
+            preview,
+            formats,
+            self._preview_generation,
+            self.is_current_preview,
+            self.preview_signals,
+            ))
+
+
+    def preview_widgets(self):
+        return (
                 (self.pbNormalSingle, 1),
                 (self.pbNormalDouble, 2),
                 (self.pbHighDurabilitySingle, 1),
                 (self.pbHighDurabilityDouble, 2),
-                ):
-            icon_size = widget.iconSize()
-            width = icon_size.width()
-            height = icon_size.height()
-            size = (width, height)
+                )
+
+
+    def is_current_preview(self, generation):
+        return generation == self._preview_generation
+
+
+    @QtCore.pyqtSlot(int, int, QtGui.QImage)
+    def preview_rendered(self, generation, index, image):
+        if not self.is_current_preview(generation):
+            return
 
-            with io.BytesIO() as icon_file:
-                preview.draw(icon_file, 'png', size=size, subparts=per_sticker)
-                icon_file.seek(0)
+        widget, _ = self.preview_widgets()[index]
+        widget.setIcon(QtGui.QIcon(QtGui.QPixmap.fromImage(image)))
 
-                pixmap = QtGui.QPixmap()
-                pixmap.loadFromData(icon_file.read(), 'png')
 
-                widget.setIcon(QtGui.QIcon(pixmap))
+    def stop_preview(self):
+        self.timPreview.stop()
+        self._preview_generation += 1
+        self.preview_pool.clear()
+        self.preview_pool.waitForDone()
 
 
     @QtCore.pyqtSlot()
@@ -248,60 +572,81 @@ class LabelerWindow(QtWidgets.QMainWindow, Ui_LabelerWindow):
         self.message(text)
 
 
-        creator = self.creators['inventory']
-        args = [creator, category, title, subtitle, description]
+        fields = collections.OrderedDict((
+            ('category', category),
+            ('title', title),
+            ('subtitle', subtitle),
+            ('description', description),
+            ))
 
-        result = subprocess.run(
-                args,
-                stdout=subprocess.PIPE,
-                timeout=60,
-                )
+        # Creator functions number the label themselves; executables take
+        # only the fields.
+        options = dict(add_serial=self.pbSerial.isChecked())
 
-        if result.returncode != 0:
-            text = 'Error preparing sticker!!! {:}'.format(result.returncode)
-            self.message(text, timeout=10000)
-            return False
+        job = self.make_job('inventory', fields, title, copies, options)
+        job.line_received.connect(self.inventory_line)
 
-        print_filename = None
+        return self.start_job(job)
 
-        for line in result.stdout.split(b'\n'):
-            if not line:
-                continue
 
-            if os.path.isfile(line):
-                for ext in (b'.txt', b'.dat', b'.json'):
-                    if line.lower().endswith(ext):
-                        success = False
-                        for attempt in range(10):
-                            try:
-                                self.inventory.append(str(line, 'utf-8'))
-                                success = True
-                            except BlockingIOError:
-                                text = 'Waiting for inventory... {:}'.format(
-                                        attempt,
-                                        )
-                                self.message(text)
-
-                                wait_loop = QtCore.QEventLoop()
-                                QtCore.QTimer.singleShot(200, wait_loop.quit)
-                                wait_loop.exec_()
-
-                        if not success:
-                            with open('lost-inventory.txt', 'a') as F:
-                                print(str(line, 'utf-8'), file=F)
-                            text = ' '.join((
-                                'Could not queue',
-                                title,
-                                'for inventory!',
-                                ))
-                            self.message(text, timeout=10000)
-                            return False
-
-                        break
-                if line.lower().endswith(b'.pdf'):
-                    print_filename = line
-
-        return self.print_copies(print_filename, copies, title=title)
+    @QtCore.pyqtSlot(object, bytes)
+    def inventory_line(self, job, line):
+        if not os.path.isfile(line):
+            return
+
+        for ext in (b'.txt', b'.dat', b'.json'):
+            if line.lower().endswith(ext):
+                # Only saved once the creator has exited successfully.
+                path = str(line, 'utf-8')
+                job.inventory_paths.append(path)
+
+                # The raster sticker is laid out from what the creator
+                # recorded, which may differ from the form, e.g. by a
+                # serial number.
+                if self.raster_printer and ext == b'.txt':
+                    job.preview = raster.recorded_preview(path)
+
+                break
+
+        if line.lower().endswith(b'.pdf'):
+            job.print_filename = line
+
+
+    def save_inventory(self, job):
+        paths, job.inventory_paths = job.inventory_paths, []
+
+        # Counted in full up front: a future that is already resolved runs
+        # its callback right away.
+        job.inventory_pending = len(paths)
+
+        for path in paths:
+            def saved(future, path=path):
+                self.inventory_signals.saved.emit(
+                        job,
+                        path,
+                        future.exception(),
+                        )
+
+            self.inventory.append_async(path).add_done_callback(saved)
+
+
+    @QtCore.pyqtSlot(object, str, object)
+    def inventory_saved(self, job, path, error):
+        job.inventory_pending -= 1
+
+        if error:
+            with open('lost-inventory.txt', 'a') as F:
+                print(path, file=F)
+            text = ' '.join((
+                'Could not queue',
+                job.title,
+                'for inventory!',
+                ))
+            self.message(text, timeout=10000)
+            job.error = 'inventory'
+
+        if not job.inventory_pending:
+            self.job_finished(job)
 
 
     def print_plain(self, copies):
@@ -315,61 +660,162 @@ class LabelerWindow(QtWidgets.QMainWindow, Ui_LabelerWindow):
         self.message(text)
 
 
-        creator = self.creators['plain']
-        args = [creator, plain]
+        fields = collections.OrderedDict((
+            ('text', plain),
+            ))
+
+        job = self.make_job('plain', fields, plain, copies)
+        job.line_received.connect(self.plain_line)
+        job.preview = raster.plain_preview(plain)
+
+        return self.start_job(job)
 
-        result = subprocess.run(
+
+    @QtCore.pyqtSlot(object, bytes)
+    def plain_line(self, job, line):
+        job.print_filename = line
+
+
+    def make_job(self, kind, fields, title, copies, options=None):
+        creator = self.creators[kind]
+        args = [creator] + list(fields.values())
+
+        job = CreatorJob(
+                kind,
                 args,
-                stdout=subprocess.PIPE,
-                timeout=60,
+                title,
+                copies,
+                function=self.creator_functions[kind],
+                kwargs=dict(fields, **(options or {})),
+                pool=(
+                    self.worker_pool if creator.startswith('pool:')
+                    else self.creator_pool
+                    ),
+                parent=self,
                 )
+        job.subparts = self.per_sticker
+
+        return job
+
 
-        if result.returncode != 0:
-            text = 'Error preparing sticker!!! {:}'.format(result.returncode)
+    def start_job(self, job):
+        job.item = QtWidgets.QListWidgetItem()
+        self.lwJobs.insertItem(0, job.item)
+
+        while self.lwJobs.count() > self.max_job_items:
+            self.lwJobs.takeItem(self.lwJobs.count() - 1)
+
+        job.finished.connect(self.job_finished)
+
+        self.update_job(job, 'preparing...')
+        job.start()
+
+        return True
+
+
+    def update_job(self, job, status):
+        copies = 'copy' if job.copies == 1 else 'copies'
+        text = '{title} ({copies} {copies_label}): {status}'.format(
+                title=job.title,
+                copies=job.copies,
+                copies_label=copies,
+                status=status,
+                )
+        job.item.setText(text)
+
+
+    def end_job(self, job, status):
+        self.update_job(job, status)
+        job.deleteLater()
+
+
+    @QtCore.pyqtSlot(object)
+    def job_finished(self, job):
+        if job.returncode != 0:
+            text = 'Error preparing sticker!!! {:}'.format(job.returncode)
             self.message(text, timeout=10000)
-            return False
+            self.end_job(job, 'failed ({:})'.format(job.returncode))
+            return
 
-        print_filename = result.stdout.strip(b'\n')
+        if job.inventory_paths:
+            self.update_job(job, 'saving inventory...')
+            self.save_inventory(job)
+            return
 
-        if not os.path.isfile(print_filename):
+        if job.error:
+            self.end_job(job, 'failed ({:})'.format(job.error))
+            return
+
+        if not job.print_filename or not os.path.isfile(job.print_filename):
             text = ''.join((
                 'Could not determine output filename from ',
-                creator,
+                job.args[0],
                 '!',
                 ))
             self.message(text, timeout=10000)
-            return False
+            self.end_job(job, 'failed (no output)')
+            return
 
-        return self.print_copies(print_filename, copies, title=plain)
+        self.update_job(job, 'printing...')
 
+        # The raster backend prints from the preview rather than the PDF;
+        # without one, as when the creator recorded no title, the PDF is
+        # printed.
+        preview = job.preview if self.raster_printer else None
 
-    def print_copies(self, filename, copies, title=None):
-        for copy in range(1, copies + 1):
-            text = 'Printing # {copy} of {copies}...'.format(
-                    copy=copy,
-                    copies=copies,
-                    )
-            self.message(text)
+        if self.print_copies(
+                job.print_filename,
+                job.copies,
+                title=job.title,
+                preview=preview,
+                subparts=job.subparts,
+                ):
+            self.end_job(job, 'queued')
+        else:
+            self.end_job(job, 'failed (printer)')
+
+
+    def print_copies(self, filename, copies, title=None, preview=None,
+            subparts=1):
+        copy = 'copy' if copies == 1 else 'copies'
+        text = 'Printing {copies} {copy}...'.format(
+                copies=copies,
+                copy=copy,
+                )
+        self.message(text)
 
-            args = ['echo', 'lp', '-d', self.printer, filename]
+        if preview:
+            results = self.raster_printer.submit_preview(
+                    preview,
+                    copies,
+                    subparts=subparts,
+                    )
+        else:
+            results = self.printer.submit(filename, copies)
 
-            result = subprocess.run(args, timeout=10)
+        if not results:
+            text = 'Could not lay out {:} for the printer!!!'.format(
+                    title or filename,
+                    )
+            self.message(text, timeout=10000)
+            return False
 
+        for result in results:
             if result.returncode != 0:
-                text = 'Error printing copy # {:}!!! {:}'.format(
-                        copy,
+                text = 'Error printing {:}!!! {:}'.format(
+                        title or filename,
                         result.returncode,
                         )
                 self.message(text, timeout=10000)
                 return False
 
-        copy = 'copy' if copies == 1 else 'copies'
         text = 'Queued {copies} {copy}'.format(
                 copies=copies,
                 copy=copy,
                 )
         if title:
             text += ' of ' + title
+        text += ' in {:.1f} s'.format(sum(r.latency for r in results))
         self.message(text)
 
         return True
@@ -389,7 +835,7 @@ class LabelerWindow(QtWidgets.QMainWindow, Ui_LabelerWindow):
 
     @QtCore.pyqtSlot(int)
     def tab_changed(self, index):
-        self.update_preview()
+        self.schedule_preview()
 
 
     def message(self, content, timeout=5000):
@@ -422,5 +868,6 @@ if __name__ == '__main__':
     """)
     win = LabelerWindow(creators, inventory_file, printer)
     win.show()
-    app.aboutToQuit.connect(win.timPreview.stop)
+    app.aboutToQuit.connect(win.stop_preview)
+    app.aboutToQuit.connect(win.inventory.close)
     sys.exit(app.exec_())
@@ -0,0 +1,290 @@
+#!/usr/bin/python3
+
+import concurrent.futures
+import json
+import os
+import os.path
+import queue
+import select
+import subprocess
+import sys
+import threading
+import time
+import traceback
+
+
+class WorkerError(Exception):
+    pass
+
+
+class WorkerGone(WorkerError):
+    """
+    The worker exited before answering: the request could not be written
+    or its output ended without a response.
+    """
+
+
+class Worker(object):
+    """
+    One long-lived label generation process, spoken to in JSON lines over
+    its stdin and stdout.
+    """
+
+    def __init__(self, command):
+        self.command = command
+        self.process = None
+        self.requests = 0
+        self.start()
+
+
+    def start(self):
+        self.process = subprocess.Popen(
+                self.command,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                )
+
+
+    def restart(self):
+        self.stop()
+        self.start()
+
+
+    def stop(self):
+        if self.process.poll() is None:
+            self.process.stdin.close()
+            try:
+                self.process.wait(timeout=1)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+
+
+    def alive(self):
+        return self.process.poll() is None
+
+
+    def call(self, request, timeout):
+        self.requests += 1
+        request = dict(request, id=self.requests)
+
+        try:
+            self.process.stdin.write(json.dumps(request).encode() + b'\n')
+            self.process.stdin.flush()
+        except (BrokenPipeError, ValueError):
+            raise WorkerGone('worker {:} is gone'.format(self.process.pid))
+
+        ready, _, _ = select.select([self.process.stdout], [], [], timeout)
+        if not ready:
+            raise WorkerError('worker {:} timed out'.format(self.process.pid))
+
+        line = self.process.stdout.readline()
+        if not line:
+            raise WorkerGone('worker {:} exited'.format(self.process.pid))
+
+        response = json.loads(line)
+
+        if response.get('id') != request['id']:
+            raise WorkerError('worker {:} is out of sync'.format(
+                self.process.pid,
+                ))
+
+        return response
+
+
+class LabelWorkerPool(object):
+    """
+    Pool of pre-warmed label generation processes.
+
+    Every worker imports the creators, reportlab and qrcode once at startup
+    and then serves jobs until the pool is closed, so the interpreter start
+    and import cost is paid per worker rather than per label. Workers that
+    die, time out or fail a health check are restarted.
+    """
+
+    def __init__(self, size=2, timeout=60, health_interval=None):
+        self.size = size
+        self.timeout = timeout
+        self.restarts = 0
+
+        command = [sys.executable, os.path.abspath(__file__), '--worker']
+
+        self._workers = [Worker(command) for i in range(size)]
+        self._idle = queue.Queue()
+        for worker in self._workers:
+            self._idle.put(worker)
+
+        self._closed = threading.Event()
+
+        if health_interval:
+            thread = threading.Thread(
+                    target=self._health_loop,
+                    args=(health_interval,),
+                    daemon=True,
+                    )
+            thread.start()
+
+
+    def _call(self, request, timeout):
+        worker = self._idle.get()
+
+        if not worker.alive():
+            self.restarts += 1
+            worker.restart()
+
+        try:
+            return worker.call(request, timeout)
+        except WorkerError:
+            self.restarts += 1
+            worker.restart()
+            raise
+        finally:
+            self._idle.put(worker)
+
+
+    def submit(self, creator, **kwargs):
+        """
+        Run creator ('module:function') in a worker with kwargs and return
+        the output paths. A job whose worker died without answering is
+        retried once on a fresh worker; one that timed out is not, since the
+        creator may still have done its work.
+        """
+        request = dict(creator=creator, kwargs=kwargs)
+
+        try:
+            response = self._call(request, self.timeout)
+        except WorkerGone:
+            response = self._call(request, self.timeout)
+
+        if 'error' in response:
+            raise RuntimeError(response['error'])
+
+        return response['paths']
+
+
+    def health_check(self, timeout=5):
+        """
+        Ping the workers one at a time as they become idle, restarting those
+        that do not answer. Returns the number of workers restarted.
+        """
+        restarted = 0
+
+        for i in range(self.size):
+            try:
+                self._call(dict(ping=True), timeout)
+            except WorkerError:
+                restarted += 1
+
+        return restarted
+
+
+    def _health_loop(self, interval):
+        while not self._closed.wait(interval):
+            self.health_check()
+
+
+    def close(self):
+        self._closed.set()
+
+        for worker in self._workers:
+            worker.stop()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+_shared_pool = None
+_shared_lock = threading.Lock()
+
+
+def shared_pool():
+    """
+    The process-wide pool used by 'pool:module:function' creators, sized by
+    the LABELPOOL_SIZE environment variable.
+    """
+    global _shared_pool
+
+    with _shared_lock:
+        if _shared_pool is None:
+            size = int(os.environ.get('LABELPOOL_SIZE', 2))
+            _shared_pool = LabelWorkerPool(size=size, health_interval=60)
+
+        return _shared_pool
+
+
+def serve(infile, outfile):
+    # Pay for the heavy imports before the first job arrives.
+    import labelcreator
+    import qrcode
+    import reportlab.pdfgen.canvas
+
+    functions = {}
+
+    for line in infile:
+        request = json.loads(line)
+        response = dict(id=request.get('id'))
+
+        if request.get('ping'):
+            response['pong'] = os.getpid()
+        else:
+            try:
+                creator = request['creator']
+                if creator not in functions:
+                    functions[creator] = labelcreator.load(creator)
+
+                paths = functions[creator](**request['kwargs'])
+                response['paths'] = [str(path) for path in paths]
+            except Exception as e:
+                traceback.print_exc()
+                response['error'] = '{:}: {:}'.format(type(e).__name__, e)
+
+        outfile.write(json.dumps(response) + '\n')
+        outfile.flush()
+
+
+if __name__ == '__main__':
+    if sys.argv[1:] == ['--worker']:
+        sys.stdout = sys.stderr
+        serve(sys.stdin, sys.__stdout__)
+        sys.exit(0)
+
+    # Batch mode: labelpool.py SIZE module:function < jobs.jsonl, with one
+    # JSON object of creator arguments per line.
+    size, creator = sys.argv[1:3]
+
+    start = time.perf_counter()
+
+    with LabelWorkerPool(size=int(size)) as pool:
+        with concurrent.futures.ThreadPoolExecutor(pool.size) as executor:
+            jobs = [
+                    executor.submit(pool.submit, creator, **json.loads(line))
+                    for line in sys.stdin
+                    if line.strip()
+                    ]
+
+            failed = 0
+
+            for number, job in enumerate(jobs, 1):
+                try:
+                    paths = job.result()
+                except Exception as e:
+                    failed += 1
+                    print('job {:}: {:}'.format(number, e), file=sys.stderr)
+                    continue
+
+                for path in paths:
+                    print(path)
+
+    print('{:} jobs, {:} failed, in {:.2f} s'.format(
+        len(jobs),
+        failed,
+        time.perf_counter() - start,
+        ), file=sys.stderr)
+
+    if failed:
+        sys.exit(1)
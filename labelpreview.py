@@ -1,20 +1,76 @@
 #!/usr/bin/python3
 
-import io
+import collections
+import math
+import os
 import os.path
 import PIL.Image
 import PIL.ImageDraw
-import PIL.ImageFont
 import sys
+import threading
+
+import fontcache
+
+
+class ImageCache(object):
+    """
+    Decoded images shared by all previews, keyed by path and reloaded only
+    when the file's mtime changes.
+    """
+
+    def __init__(self):
+        self._images = {}
+        self._lock = threading.Lock()
+
+
+    @staticmethod
+    def mtime(filename):
+        """
+        The mtime images of filename are cached by, or None if it is gone.
+        """
+        try:
+            return os.stat(filename).st_mtime_ns
+        except OSError:
+            return None
+
+
+    def load(self, filename):
+        path = os.path.abspath(filename)
+        mtime = os.stat(path).st_mtime_ns
+
+        with self._lock:
+            cached = self._images.get(path)
+
+            if cached and cached[0] == mtime:
+                return cached[1]
+
+            with PIL.Image.open(path) as loaded:
+                image = loaded.convert('RGB')
+
+            self._images[path] = (mtime, image)
+            return image
+
+
+fonts = fontcache.FontCache(('FreeSans', 'FreeMonoBold', 'FreeSansBold'))
+images = ImageCache()
 
 
 class LabelPreview(object):
+    max_font_size = 256
+
     def __init__(self, category, title, subtitle, qrfilename='qr.png'):
         self.category = category
         self.title = title
         self.subtitle = subtitle
         self.qrfilename = qrfilename
 
+        # The text is the same for every format the preview is rendered in,
+        # so measurements, text blocks and finished images are kept per
+        # preview and shared between formats.
+        self._measures = {}
+        self._text_blocks = {}
+        self._renders = {}
+
 
     def __eq__(A, B):
         fields = ('category', 'title', 'subtitle', 'qrfilename')
@@ -32,76 +88,177 @@ class LabelPreview(object):
         return not (A == B)
 
 
-    def draw_text(self, area_size, font_size):
-        parts = (
+    def text_parts(self):
+        return (
                 (self.category, 'FreeSans', 0.8),
                 (self.title, 'FreeMonoBold', 1.0),
                 (self.subtitle, 'FreeSansBold', 0.8),
                 )
 
-        text_image = PIL.Image.new('RGB', area_size, color='white')
 
-        draw = PIL.ImageDraw.Draw(text_image)
+    def measure_text(self, font_size):
+        try:
+            return self._measures[font_size]
+        except KeyError:
+            used_size = self._measures[font_size] = self._measure_text(font_size)
+            return used_size
 
 
+    def _measure_text(self, font_size):
         used_size = [0, 0]
 
-        for text, font_name, scale in parts:
-            font = PIL.ImageFont.truetype(font_name, size=round(font_size*scale))
+        for text, font_name, scale in self.text_parts():
+            font = fonts.get(font_name, round(font_size*scale))
 
-            text_size = draw.textsize(text, font=font)
+            _, _, text_width, text_height = font.getbbox(text)
 
-            used_size[0] = max(used_size[0], text_size[0])
-            used_size[1] += text_size[1] * 1.1
+            used_size[0] = max(used_size[0], text_width)
+            used_size[1] += text_height * 1.1
 
-        if not all(a <= b for a, b in zip(used_size, area_size)):
-            return None
+        return used_size
 
 
-        x, y = (0, (area_size[1] - used_size[1]) // 4)
+    @staticmethod
+    def text_fits(used_size, area_size):
+        return all(a <= b for a, b in zip(used_size, area_size))
 
-        for text, font_name, scale in parts:
-            font = PIL.ImageFont.truetype(font_name, size=round(font_size*scale))
 
-            text_size = draw.textsize(text, font=font)
-            draw.text((x, y), text, fill='black', font=font)
+    def fit_font_size(self, area_size):
+        """
+        Find the largest font size whose text block fits into area_size.
 
-            y += text_size[1] * 1.1
+        Returns (font_size, used_size), or (None, None) if even the smallest
+        size does not fit. Only measures; nothing is rasterized.
+        """
+        lo, hi = 0, self.max_font_size
+        lo_used = None
 
-        if y > area_size[1]:
-            return None
+        # Text extents scale almost linearly with the font size, so the first
+        # measurement predicts the answer to within a pixel or two of hinting
+        # error. Probe that guess and its neighbour, then bisect what is left.
+        probe = hi
+        step = 0
+
+        while lo < hi:
+            used_size = self.measure_text(probe)
+            fits = self.text_fits(used_size, area_size)
+
+            if fits:
+                lo, lo_used = probe, used_size
+            else:
+                hi = probe - 1
+
+            if step == 0:
+                ratios = [a / u for a, u in zip(area_size, used_size) if u]
+                probe = int(probe * min(ratios)) if ratios else hi
+            elif step == 1:
+                probe = probe + 1 if fits else probe - 1
+            else:
+                probe = (lo + hi + 1) // 2
+
+            probe = min(max(probe, lo + 1), hi)
+            step += 1
+
+        if not lo:
+            return None, None
+
+        return lo, lo_used
+
+
+    def text_block(self, font_size, rotate=False):
+        """
+        Return the text rasterized at font_size, cropped to its measured
+        size and optionally rotated by 90 degrees.
+        """
+        key = (font_size, rotate)
+
+        try:
+            return self._text_blocks[key]
+        except KeyError:
+            pass
+
+        if rotate:
+            block = self.text_block(font_size).rotate(90, expand=1)
+        else:
+            block = self._draw_text_block(font_size)
+
+        self._text_blocks[key] = block
+        return block
+
+
+    def _draw_text_block(self, font_size):
+        used_size = self.measure_text(font_size)
+        block_size = (max(1, used_size[0]), max(1, math.ceil(used_size[1])))
+
+        text_image = PIL.Image.new('RGB', block_size, color='white')
+
+        draw = PIL.ImageDraw.Draw(text_image)
+
+        x, y = (0, 0)
+
+        for text, font_name, scale in self.text_parts():
+            font = fonts.get(font_name, round(font_size*scale))
+
+            _, _, _, text_height = font.getbbox(text)
+            draw.text((x, y), text, fill='black', font=font)
+
+            y += text_height * 1.1
 
         return text_image
 
 
-    def draw(self, outfile, format, size=(650, 200), subparts=1):
+    def render(self, size=(650, 200), subparts=1):
+        """
+        Render the preview and return it as an RGB PIL.Image, or None if the
+        text cannot be fitted.
+
+        Results are kept for the lifetime of the preview, so rendering the
+        same format twice, or several formats that share a sub-label size,
+        draws the sub-label only once, until the QR file changes. The
+        returned image is shared and must not be modified.
+        """
+        key = (
+                tuple(size),
+                subparts,
+                self.qrfilename and images.mtime(self.qrfilename),
+                )
+
+        try:
+            return self._renders[key]
+        except KeyError:
+            pass
+
+        image = self._renders[key] = self._render(size, subparts)
+        return image
+
+
+    def _render(self, size, subparts):
         width, height = size
 
         if subparts > 1:
             margin = width // (subparts * 20)
             subwidth = (width - ((subparts - 1) * margin)) // subparts
 
-            with io.BytesIO() as subfile:
-                self.draw(subfile, format, size=(subwidth, height), subparts=1)
+            sub_image = self.render(size=(subwidth, height), subparts=1)
 
-                subfile.seek(0)
-                sub_image = PIL.Image.open(subfile)
+            if not sub_image:
+                return None
 
-                full_image = PIL.Image.new('RGB', size, color='white')
+            full_image = PIL.Image.new('RGB', size, color='white')
 
-                x = 0
-                for i in range(subparts):
-                    full_image.paste(sub_image, (x, 0))
-                    x += subwidth + margin
+            x = 0
+            for i in range(subparts):
+                full_image.paste(sub_image, (x, 0))
+                x += subwidth + margin
 
-                full_image.save(outfile, format)
-                return True
+            return full_image
 
 
         image = PIL.Image.new('RGB', size, color='white')
 
-        if self.qrfilename:
-            qr = PIL.Image.open(self.qrfilename)
+        qr = self.qr_image(height)
+
+        if qr:
             image.paste(qr, (width - qr.width, (height - qr.height) // 2))
         else:
             class EmptyQR(object):
@@ -118,30 +275,135 @@ class LabelPreview(object):
             text_max_size.reverse()
 
 
-        text_image = None
+        font_size, used_size = self.fit_font_size(text_max_size)
 
-        font_size = 256
-        for attempt in range(50):
-            text_image = self.draw_text(text_max_size, font_size)
+        if not font_size:
+            return None
 
-            if text_image:
-                break
+        text_offset = int((text_max_size[1] - used_size[1]) // 4)
 
-            font_size = 7 * font_size // 8
+        if rotate:
+            block = self.text_block(font_size, rotate=True)
+            image.paste(block, (text_offset, text_max_size[0] - block.height))
+        else:
+            image.paste(self.text_block(font_size), (0, text_offset))
 
-        if not text_image:
-            return False
+        return image
 
-        if rotate:
-            text_image = text_image.rotate(90, expand=1)
 
-        image.paste(text_image, (0, 0))
+    def qr_image(self, height):
+        """
+        The QR code to place at the right edge of a label height pixels
+        tall, or None for a label without one. Previews show the file at its
+        own size.
+        """
+        if not self.qrfilename:
+            return None
+
+        return images.load(self.qrfilename)
+
+
+    def draw(self, outfile, format, size=(650, 200), subparts=1):
+        image = self.render(size=size, subparts=subparts)
+
+        if not image:
+            return False
 
         image.save(outfile, format)
 
         return True
 
 
+class PreviewCache(object):
+    """
+    LRU of rendered preview images, bounded by the bytes of pixel data held
+    rather than by the number of entries. The QR file's mtime is part of
+    the key, so a replaced file is not served from the cache.
+    """
+
+    def __init__(self, max_bytes=32 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.used_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+        self._images = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+
+    @staticmethod
+    def key(preview, size, subparts):
+        return (
+                preview.category,
+                preview.title,
+                preview.subtitle,
+                preview.qrfilename,
+                preview.qrfilename and images.mtime(preview.qrfilename),
+                tuple(size),
+                subparts,
+                )
+
+
+    @staticmethod
+    def image_bytes(image):
+        width, height = image.size
+        return width * height * len(image.getbands())
+
+
+    def render(self, preview, size=(650, 200), subparts=1):
+        key = self.key(preview, size, subparts)
+
+        with self._lock:
+            try:
+                image = self._images[key]
+            except KeyError:
+                self.misses += 1
+            else:
+                self._images.move_to_end(key)
+                self.hits += 1
+                return image
+
+        image = preview.render(size=size, subparts=subparts)
+
+        if image:
+            self.put(key, image)
+
+        return image
+
+
+    def put(self, key, image):
+        with self._lock:
+            old = self._images.pop(key, None)
+            if old:
+                self.used_bytes -= self.image_bytes(old)
+
+            self._images[key] = image
+            self.used_bytes += self.image_bytes(image)
+
+            while self.used_bytes > self.max_bytes and self._images:
+                _, evicted = self._images.popitem(last=False)
+                self.used_bytes -= self.image_bytes(evicted)
+
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return (self.hits / lookups) if lookups else 0.0
+
+
+    def stats(self):
+        with self._lock:
+            return dict(
+                    hits=self.hits,
+                    misses=self.misses,
+                    hit_rate=self.hit_rate(),
+                    images=len(self._images),
+                    bytes=self.used_bytes,
+                    )
+
+
+previews = PreviewCache()
+
+
 if __name__ == '__main__':
     category, title, subtitle, qrfilename, filename = sys.argv[1:]
 
@@ -153,4 +415,9 @@ if __name__ == '__main__':
     for i in range(1, 3):
         full_filename = '{:}-{:}{:}'.format(file_base, i, ext)
 
-        LP.draw(full_filename, ext.strip('.'), subparts=i)
+        image = previews.render(LP, subparts=i)
+
+        if image:
+            image.save(full_filename, ext.strip('.'))
+
+    print(previews.stats())
@@ -0,0 +1,369 @@
+#!/usr/bin/python3
+
+import itertools
+
+
+from reportlab.pdfgen.canvas import Canvas
+from reportlab.lib.pagesizes import A4, letter
+from reportlab.lib.styles import ParagraphStyle
+from reportlab.lib.units import inch, mm
+from reportlab.pdfbase.pdfmetrics import stringWidth
+from reportlab.platypus import Paragraph
+
+
+class SheetTemplate(object):
+    """
+    Geometry of one sticker stock: a grid of cols x rows labels filling
+    label_section_size, centered on the page, each printed inside margin.
+
+    The origin of every cell's printable area is computed once, in the
+    order labels are placed: down the first column, then down the next.
+    """
+
+    def __init__(self, name, pagesize, label_section_size, cols, rows,
+            margin=(8 * mm, 6 * mm)):
+        self.name = name
+        self.pagesize = pagesize
+        self.label_section_size = label_section_size
+        self.cols = cols
+        self.rows = rows
+        self.margin = margin
+
+        margin_x, margin_y = (
+                (full - printable) / 2
+                for full, printable in zip(pagesize, label_section_size)
+                )
+
+        pitch_x, pitch_y = (
+                printable / count
+                for printable, count in zip(label_section_size, (cols, rows))
+                )
+
+        self.cell_size = (pitch_x, pitch_y)
+        self.content_size = tuple(
+                pitch - 2 * inset
+                for pitch, inset in zip(self.cell_size, margin)
+                )
+
+        self.cells = tuple(
+                (
+                    margin_x + pitch_x * xindex + margin[0],
+                    margin_y + pitch_y * (rows - yindex - 1) + margin[1],
+                    )
+                for xindex, yindex in itertools.product(range(cols), range(rows))
+                )
+
+
+    def __len__(self):
+        return len(self.cells)
+
+
+templates = {
+        template.name: template
+        for template in (
+            SheetTemplate('letter-2x6', letter, (208 * mm, 254 * mm), 2, 6),
+            SheetTemplate('letter-2x10', letter, (8 * inch, 10 * inch), 2, 10),
+            SheetTemplate('letter-3x10', letter, (8.25 * inch, 10 * inch), 3, 10),
+            SheetTemplate('a4-2x7', A4, (198.2 * mm, 266.7 * mm), 2, 7),
+            SheetTemplate('a4-3x8', A4, (210 * mm, 272 * mm), 3, 8),
+            )
+        }
+
+
+def get_template(template):
+    if isinstance(template, SheetTemplate):
+        return template
+
+    return templates[template]
+
+
+def parse_options(args, options):
+    """
+    Split the leading --name[=value] options off the command line args, as
+    the label sheet scripts take them. options maps every known name to a
+    function converting its value, or to None for a flag without one; '--'
+    ends the options.
+
+    Returns the options as keyword arguments and the remaining args, which
+    must at least name the output file. Raises ValueError otherwise.
+    """
+    args = list(args)
+    values = {}
+
+    while args and args[0].startswith('--'):
+        arg = args.pop(0)
+        if arg == '--':
+            break
+
+        name, has_value, value = arg[2:].partition('=')
+
+        if name not in options:
+            raise ValueError('unknown option --{:}'.format(name))
+
+        convert = options[name]
+
+        if convert is None:
+            if has_value:
+                raise ValueError('--{:} takes no value'.format(name))
+            value = True
+        else:
+            if not has_value:
+                raise ValueError('--{:} needs a value'.format(name))
+
+            try:
+                value = convert(value)
+            except (KeyError, ValueError):
+                raise ValueError('bad value for --{:}: {:}'.format(
+                    name,
+                    value,
+                    ))
+
+        values[name.replace('-', '_')] = value
+
+    if not args:
+        raise ValueError('no output file given')
+
+    return values, args
+
+
+class LabelSheet(object):
+    """
+    Lays labels out on sheets of a template and writes them to a PDF.
+
+    draw_label(label, canvas, size) renders one label into the printable
+    area of its cell, of the template's content_size, with the canvas
+    origin at its lower left corner. Labels may come from any iterable;
+    they are consumed one sheet at a time, with a new page per sheet.
+    """
+
+    def __init__(self, template='letter-2x6'):
+        self.template = get_template(template)
+
+
+    def make_pdf(self, filename, labels, draw_label):
+        template = self.template
+
+        canvas = Canvas(filename, pagesize=template.pagesize)
+
+        iter_labels = iter(labels)
+        pages = 0
+
+        while True:
+            page_labels = list(itertools.islice(iter_labels, len(template)))
+
+            if not page_labels:
+                break
+
+            for (x, y), label in zip(template.cells, page_labels):
+                canvas.saveState()
+
+                canvas.translate(x, y)
+
+                draw_label(label, canvas, template.content_size)
+
+                canvas.restoreState()
+
+            canvas.showPage()
+            pages += 1
+
+        if not pages:
+            canvas.showPage()
+
+        canvas.save()
+
+        return pages
+
+
+class LabelPage(object):
+    """
+    Labels to lay out on sheets of template, each drawn by the subclass's
+    draw_label(label, canvas, size).
+    """
+
+    def __init__(self, labels=None, template='letter-2x6'):
+        # Any iterable; make_page() consumes it one sheet at a time.
+        if labels is not None:
+            self.labels = labels
+        else:
+            self.labels = []
+
+        self.template = template
+
+
+    def make_page(self, filename):
+        return self.make_sheets(filename, self.labels, self.draw_label)
+
+
+    def make_sheets(self, filename, labels, draw_label):
+        sheet = LabelSheet(self.template)
+
+        return sheet.make_pdf(filename, labels, draw_label)
+
+
+# Points a paragraph may overshoot the frame height by and still fit, the
+# rounding slack Frame.add allows.
+height_tolerance = 1e-6
+
+
+def paragraph_style(font_size, font_name='Courier-Bold',
+        text_color=(0.0, 0.0, 0.0)):
+    return ParagraphStyle(
+            'name',
+            fontName=font_name,
+            fontSize=font_size,
+            leading=font_size,
+            textColor=text_color,
+            )
+
+
+def wrap_paragraph(text, font_size, size, font_name='Courier-Bold',
+        text_color=(0.0, 0.0, 0.0)):
+    """
+    Lay text out at font_size. Returns (paragraph, height), with paragraph
+    None when it is taller than the area (the test Frame.add applies).
+    """
+    width, height = size
+
+    style = paragraph_style(font_size, font_name, text_color)
+    paragraph = Paragraph(text, style)
+    _, paragraph_height = paragraph.wrap(width, height)
+
+    if paragraph_height > height + height_tolerance:
+        return None, paragraph_height
+
+    return paragraph, paragraph_height
+
+
+def monospace_lines(words, chars):
+    """
+    Number of lines greedy word wrapping needs for words at chars
+    characters per line. Like reportlab, a word longer than a whole line is
+    split, starting in the space left on the current line.
+    """
+    lines = 0
+    used = None
+
+    for word in words:
+        length = len(word)
+
+        if used is not None and used + 1 + length <= chars:
+            used += 1 + length
+            continue
+
+        if length > chars and used is not None and chars - used - 1 > 0:
+            length -= chars - used - 1
+
+        extra_lines = (length + chars - 1) // chars
+        lines += extra_lines
+        used = length - (extra_lines - 1) * chars
+
+    return lines
+
+
+def monospace_font_size(text, size, font_name):
+    """
+    Largest font size at which text fits into size when set in the
+    monospaced font_name, solved from the character advance.
+
+    Exactly chars characters fit on a line for sizes in the range
+    (width / (advance * (chars + 1)), width / (advance * chars)]. Within
+    that range the line count is fixed, so the height bounds the size too,
+    and the answer is the best of these per-range maxima.
+    """
+    width, height = size
+    words = text.split()
+    advance = stringWidth('M', font_name, 1)
+
+    best = 0
+    longest = len(' '.join(words))
+
+    for chars in range(1, longest + 1):
+        lines = monospace_lines(words, chars)
+        font_size = min(width / (advance * chars), height / lines)
+
+        # From the longest line on, the text is a single line at any
+        # smaller size too, so that last range is open below.
+        if chars == longest or font_size > width / (advance * (chars + 1)):
+            best = max(best, font_size)
+
+    # Stay clear of the exact boundary, where rounding decides.
+    return best * (1 - 1e-6)
+
+
+def is_monospaced(font_name):
+    return stringWidth('i', font_name, 1) == stringWidth('M', font_name, 1)
+
+
+def fit_paragraph(text, size, font_name='Courier-Bold', max_font_size=32,
+        min_font_size=1, tolerance=0.1, text_color=(0.0, 0.0, 0.0)):
+    """
+    Find the largest font size up to max_font_size at which text fits into
+    size and return the paragraph laid out at that size with its height, or
+    (None, None) if not even min_font_size fits.
+
+    Monospaced fonts are solved directly from their metrics, so normally
+    the paragraph is laid out exactly once. Proportional fonts, and the
+    rare case where reportlab wraps differently than predicted, fall back
+    to bisecting the size with real layouts.
+    """
+    words = text.split()
+
+    if not words:
+        return wrap_paragraph(
+                text, max_font_size, size, font_name, text_color)
+
+    hi = max_font_size
+
+    if is_monospaced(font_name):
+        hi = min(hi, monospace_font_size(text, size, font_name))
+
+    paragraph, paragraph_height = wrap_paragraph(
+            text, hi, size, font_name, text_color)
+
+    if paragraph:
+        return paragraph, paragraph_height
+
+    lo = min_font_size
+    best = wrap_paragraph(text, lo, size, font_name, text_color)
+
+    if not best[0]:
+        return None, None
+
+    while hi - lo > tolerance:
+        mid = (lo + hi) / 2
+        paragraph, paragraph_height = wrap_paragraph(
+                text, mid, size, font_name, text_color)
+
+        if paragraph:
+            lo, best = mid, (paragraph, paragraph_height)
+        else:
+            hi = mid
+
+    return best
+
+
+if __name__ == '__main__':
+    for name, template in sorted(templates.items()):
+        print('{:12} {:2} x {:2}  cell {:6.1f} x {:5.1f} mm'.format(
+            name,
+            template.cols,
+            template.rows,
+            template.cell_size[0] / mm,
+            template.cell_size[1] / mm,
+            ))
+
+
+def draw_text(canvas, text, size, **kwargs):
+    """
+    Draw text at the largest size fit_paragraph() finds for it, top-aligned
+    in size at the canvas origin. Returns False if it does not fit.
+    """
+    paragraph, paragraph_height = fit_paragraph(text, size, **kwargs)
+
+    if not paragraph:
+        return False
+
+    # Top-aligned, where a padding-free Frame would have put it.
+    paragraph.drawOn(canvas, 0, size[1] - paragraph_height)
+
+    return True
@@ -223,6 +223,16 @@ class Ui_LabelerWindow(object):
         self.pbPrint.setObjectName("pbPrint")
         self.gridLayout_3.addWidget(self.pbPrint, 4, 0, 1, 1)
         self.verticalLayout_2.addWidget(self.gbPrint)
+        self.gbJobs = QtWidgets.QGroupBox(self.centralwidget)
+        self.gbJobs.setObjectName("gbJobs")
+        self.verticalLayout_4 = QtWidgets.QVBoxLayout(self.gbJobs)
+        self.verticalLayout_4.setObjectName("verticalLayout_4")
+        self.lwJobs = QtWidgets.QListWidget(self.gbJobs)
+        self.lwJobs.setMaximumSize(QtCore.QSize(16777215, 150))
+        self.lwJobs.setSelectionMode(QtWidgets.QAbstractItemView.NoSelection)
+        self.lwJobs.setObjectName("lwJobs")
+        self.verticalLayout_4.addWidget(self.lwJobs)
+        self.verticalLayout_2.addWidget(self.gbJobs)
         LabelerWindow.setCentralWidget(self.centralwidget)
         self.statusbar = QtWidgets.QStatusBar(LabelerWindow)
         self.statusbar.setObjectName("statusbar")
@@ -279,6 +289,7 @@ class Ui_LabelerWindow(object):
         self.lblOutputCount.setText(_translate("LabelerWindow", "OUTPUT COUNT"))
         self.pbReset.setText(_translate("LabelerWindow", "&Reset"))
         self.pbPrint.setText(_translate("LabelerWindow", "&Print Now!"))
+        self.gbJobs.setTitle(_translate("LabelerWindow", "Label Jobs:"))
 
 
 if __name__ == "__main__":
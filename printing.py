@@ -0,0 +1,152 @@
+#!/usr/bin/python3
+
+import collections
+import subprocess
+import sys
+import time
+
+import raster
+
+
+PrintResult = collections.namedtuple(
+        'PrintResult',
+        ('filename', 'copies', 'returncode', 'latency'),
+        )
+
+
+class LpPrinter(object):
+    """
+    Submits files to a CUPS queue through lp.
+
+    In batch mode all copies of a file are sent as one spooler job carrying
+    a copy count (lp -n). Otherwise every copy is its own lp call and job,
+    which is what the labeler originally did.
+    """
+
+    def __init__(self, printer, command=('lp',), batch=True, timeout=10):
+        self.printer = printer
+        self.command = list(command)
+        self.batch = batch
+        self.timeout = timeout
+
+
+    def job_args(self, filename, copies):
+        args = self.command + ['-d', self.printer]
+
+        if copies != 1:
+            args += ['-n', str(copies)]
+
+        # Without a file, lp reads the job from its standard input.
+        if filename is None:
+            return args
+
+        return args + [filename]
+
+
+    def run(self, filename, copies, data=None):
+        start = time.perf_counter()
+
+        try:
+            result = subprocess.run(
+                    self.job_args(filename, copies),
+                    input=data,
+                    timeout=self.timeout,
+                    )
+            returncode = result.returncode
+        except subprocess.TimeoutExpired:
+            returncode = -1
+
+        return PrintResult(
+                filename,
+                copies,
+                returncode,
+                time.perf_counter() - start,
+                )
+
+
+    def submit(self, filename, copies=1):
+        """
+        Print copies of filename and return one PrintResult per spooler job.
+        Stops at the first job that fails.
+        """
+        if self.batch:
+            return [self.run(filename, copies)]
+
+        results = []
+
+        for copy in range(copies):
+            result = self.run(filename, 1)
+            results.append(result)
+
+            if result.returncode != 0:
+                break
+
+        return results
+
+
+class RasterPrinter(LpPrinter):
+    """
+    Prints label previews by piping a 1-bit raster stream to lp instead of
+    spooling a PDF, so CUPS does not have to rasterize the label again.
+
+    format is 'pwg' (image/pwg-raster, which driverless queues take as is)
+    or 'pbm'. Labels are size millimetres at dpi, and thresholded unless
+    dither is set.
+    """
+
+    def __init__(self, printer, command=('lp',), format='pwg', size=(90, 29),
+            dpi=300, dither=False, timeout=10):
+        super(RasterPrinter, self).__init__(
+                printer,
+                command=command,
+                batch=True,
+                timeout=timeout,
+                )
+
+        self.encode = raster.encoders[format]
+        self.size = size
+        self.dpi = dpi
+        self.dither = dither
+
+
+    def rasterize(self, preview, subparts=1):
+        """
+        The raster stream for preview, or None if its text does not fit.
+        """
+        image = raster.render(preview, self.size, self.dpi, subparts)
+
+        if not image:
+            return None
+
+        return self.encode(raster.bitmap(image, dither=self.dither), self.dpi)
+
+
+    def submit_preview(self, preview, copies=1, subparts=1):
+        """
+        Print copies of preview as one spooler job and return its
+        PrintResult in a list, or an empty list if the label cannot be laid
+        out.
+        """
+        data = self.rasterize(preview, subparts)
+
+        if data is None:
+            return []
+
+        return [self.run(None, copies, data=data)]
+
+
+if __name__ == '__main__':
+    printer, filename, copies = sys.argv[1:4]
+    command = sys.argv[4:] or ['lp']
+
+    for batch in (False, True):
+        backend = LpPrinter(printer, command=command, batch=batch)
+
+        results = backend.submit(filename, int(copies))
+
+        print('{:8} jobs: {:3}  failed: {:3}  total: {:.3f} s'.format(
+            'batch' if batch else 'per-copy',
+            len(results),
+            sum(1 for result in results if result.returncode != 0),
+            sum(result.latency for result in results),
+            ))
@@ -0,0 +1,268 @@
+#!/usr/bin/python3
+
+import numpy
+import PIL.Image
+import struct
+import sys
+
+import homelabel
+import inventory
+import labelpreview
+
+
+class RasterPreview(labelpreview.LabelPreview):
+    """
+    LabelPreview laid out for the printer: the QR code is generated from
+    qr_data and scaled to the largest whole number of pixels per module
+    that fits the label height.
+    """
+
+    def __init__(self, category, title, subtitle, qr_data=None):
+        super(RasterPreview, self).__init__(
+                category,
+                title,
+                subtitle,
+                qrfilename=None,
+                )
+
+        self.qr_data = qr_data
+
+
+    def qr_image(self, height):
+        if not self.qr_data:
+            return None
+
+        matrix = homelabel.make_qr_matrix(self.qr_data)
+        qr = homelabel.matrix_image(matrix, max(1, height // len(matrix)))
+
+        # Centred in the square the label keeps for it.
+        image = PIL.Image.new('RGB', (height, height), color='white')
+        image.paste(qr, ((height - qr.width) // 2, (height - qr.height) // 2))
+
+        return image
+
+
+def inventory_preview(category, title, subtitle):
+    """
+    The inventory sticker labelcreator.inventory_label makes, as a preview.
+    The title is used as given, so for a creator that adds a serial number
+    use recorded_preview() instead.
+    """
+    label = homelabel.Label(title, add_serial=False)
+
+    return RasterPreview(category, title, subtitle, qr_data=label.qr_data())
+
+
+def recorded_preview(path):
+    """
+    The inventory sticker as recorded in the description a creator spooled
+    to path, serial number included, or None if no title can be read from
+    it.
+    """
+    entry = inventory.read_entry(path)
+
+    if not entry.title:
+        return None
+
+    return inventory_preview(
+            entry.category or '',
+            entry.title,
+            entry.subtitle or '',
+            )
+
+
+def plain_preview(text):
+    return RasterPreview('', text, '')
+
+
+def bayer_matrix(order=3):
+    """
+    Ordered dither thresholds for a 2**order square tile, spread evenly
+    over 0..255.
+    """
+    matrix = numpy.zeros((1, 1))
+
+    for i in range(order):
+        matrix = numpy.block([
+            [4 * matrix, 4 * matrix + 2],
+            [4 * matrix + 3, 4 * matrix + 1],
+            ])
+
+    return (matrix + 0.5) * 256 / matrix.size
+
+
+def bitmap(image, threshold=128, dither=False):
+    """
+    Reduce image to a boolean array that is True where the printer should
+    put ink, either by a fixed threshold or by ordered dithering.
+    """
+    gray = numpy.asarray(image.convert('L'))
+
+    if dither:
+        tile = bayer_matrix()
+        height, width = gray.shape
+        reps = (-(-height // len(tile)), -(-width // len(tile)))
+        threshold = numpy.tile(tile, reps)[:height, :width]
+
+    return gray < threshold
+
+
+def encode_pbm(bits):
+    """
+    A binary (P4) PBM of bits. Rows are padded to whole bytes, which is
+    exactly what numpy.packbits does.
+    """
+    height, width = bits.shape
+    header = 'P4\n{:} {:}\n'.format(width, height).encode('ascii')
+
+    return header + numpy.packbits(bits, axis=1).tobytes()
+
+
+def pwg_header(width, height, dpi, bytes_per_line):
+    """
+    The 1796 byte PWG raster page header for a black_1 page: one bit per
+    pixel, 1 meaning black.
+    """
+    header = bytearray(1796)
+
+    header[0:9] = b'PwgRaster'
+
+    fields = (
+            (276, dpi),
+            (280, dpi),
+            (340, 1),                    # NumCopies
+            (352, round(width * 72 / dpi)),
+            (356, round(height * 72 / dpi)),
+            (372, width),
+            (376, height),
+            (384, 1),                    # BitsPerColor
+            (388, 1),                    # BitsPerPixel
+            (392, bytes_per_line),
+            (400, 3),                    # ColorSpace: black
+            (420, 1),                    # NumColors
+            (452, 1),                    # TotalPageCount
+            (456, 1),                    # CrossFeedTransform
+            (460, 1),                    # FeedTransform
+            )
+
+    for offset, value in fields:
+        struct.pack_into('>I', header, offset, value)
+
+    return bytes(header)
+
+
+def encode_pwg_line(line):
+    """
+    PackBits-style run length encoding of one packed raster line: a control
+    byte n < 128 repeats the next byte n + 1 times, n > 128 is followed by
+    257 - n literal bytes.
+    """
+    boundaries = numpy.concatenate((
+        [0],
+        numpy.flatnonzero(line[1:] != line[:-1]) + 1,
+        [len(line)],
+        ))
+
+    data = line.tobytes()
+    out = bytearray()
+
+    # Runs of one byte are merged into literal stretches.
+    runs = []
+    for start, end in zip(boundaries[:-1].tolist(), boundaries[1:].tolist()):
+        if end - start == 1 and runs and runs[-1][2]:
+            runs[-1][1] = end
+        else:
+            runs.append([start, end, end - start == 1])
+
+    for start, end, literal in runs:
+        while start < end:
+            count = min(end - start, 128)
+
+            if not literal:
+                out += bytes((count - 1, data[start]))
+            elif count == 1:
+                out += bytes((0, data[start]))
+            else:
+                out.append(257 - count)
+                out += data[start:start + count]
+
+            start += count
+
+    return bytes(out)
+
+
+def encode_pwg(pages, dpi):
+    """
+    A PWG raster stream (image/pwg-raster) with one page per bitmap.
+    Identical consecutive lines, such as the blank ones, are sent once
+    with a repeat count.
+    """
+    out = [b'RaS2']
+
+    for bits in pages:
+        packed = numpy.packbits(bits, axis=1)
+        height, bytes_per_line = packed.shape
+
+        out.append(pwg_header(bits.shape[1], height, dpi, bytes_per_line))
+
+        # Where each line differs from the one before it.
+        changes = numpy.flatnonzero((packed[1:] != packed[:-1]).any(axis=1))
+        starts = numpy.concatenate(([0], changes + 1, [height])).tolist()
+
+        for start, end in zip(starts[:-1], starts[1:]):
+            line = encode_pwg_line(packed[start])
+
+            while start < end:
+                repeat = min(end - start, 256)
+                out.append(bytes((repeat - 1,)) + line)
+                start += repeat
+
+    return b''.join(out)
+
+
+encoders = {
+        'pbm': lambda bits, dpi: encode_pbm(bits),
+        'pwg': lambda bits, dpi: encode_pwg([bits], dpi),
+        }
+
+
+def render(preview, size, dpi=300, subparts=1, margin=1.5):
+    """
+    Render preview at printer resolution for a label of size millimetres,
+    inset by margin millimetres on every side. Returns an RGB PIL.Image,
+    or None if the text does not fit.
+    """
+    pixels = tuple(round(length * dpi / 25.4) for length in size)
+    inset = round(margin * dpi / 25.4)
+
+    content = preview.render(
+            size=tuple(length - 2 * inset for length in pixels),
+            subparts=subparts,
+            )
+
+    if not content:
+        return None
+
+    image = PIL.Image.new('RGB', pixels, color='white')
+    image.paste(content, (inset, inset))
+
+    return image
+
+
+if __name__ == '__main__':
+    # raster.py FORMAT OUTFILE CATEGORY TITLE SUBTITLE [--dither]
+    args = sys.argv[1:]
+
+    dither = '--dither' in args
+    if dither:
+        args.remove('--dither')
+
+    format, filename, category, title, subtitle = args
+
+    image = render(inventory_preview(category, title, subtitle), (90, 29))
+
+    if not image:
+        sys.exit('Label text does not fit')
+
+    with open(filename, 'wb') as F:
+        F.write(encoders[format](bitmap(image, dither=dither), 300))
@@ -0,0 +1,38 @@
+#!/usr/bin/python3
+
+import sqlite3
+import threading
+
+
+class ThreadConnections(object):
+    """
+    One SQLite connection to filename per thread, in WAL mode, for the
+    stores that are used from the GUI and from their flusher thread.
+    """
+
+    def __init__(self, filename, timeout=5):
+        self.filename = filename
+        self.timeout = timeout
+        self._local = threading.local()
+
+
+    def get(self):
+        connection = getattr(self._local, 'connection', None)
+
+        if connection is None:
+            connection = sqlite3.connect(self.filename, timeout=self.timeout)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+
+        return connection
+
+
+    def close(self):
+        """
+        Close the calling thread's connection.
+        """
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
@@ -0,0 +1,68 @@
+import os
+
+import inventory
+
+
+def test_append_within_one_mtime_tick(tmp_path):
+    filename = str(tmp_path / 'inventory.txt')
+    inv = inventory.Inventory(filename)
+
+    inv.append('a')
+    inv.append('b')
+    mtime = os.stat(filename).st_mtime_ns
+
+    # A write in the same clock tick leaves the mtime where it was.
+    with open(filename, 'a') as F:
+        F.write('c\nd\n')
+    os.utime(filename, ns=(mtime, mtime))
+
+    assert len(inv) == 4
+    assert inv[2] == 'c'
+    assert inv[3] == 'd'
+
+
+def test_rewritten_log(tmp_path):
+    filename = str(tmp_path / 'inventory.txt')
+    inv = inventory.Inventory(filename)
+
+    inv.append('aaaa')
+    inv.append('bbbb')
+    assert len(inv) == 2
+
+    with open(filename, 'w') as F:
+        F.write('xxxxxxxx\n')
+
+    assert len(inv) == 1
+    assert inv[0] == 'xxxxxxxx'
+
+
+def test_unterminated_last_line(tmp_path):
+    filename = str(tmp_path / 'inventory.txt')
+
+    with open(filename, 'w') as F:
+        F.write('a\nb\nc')
+
+    inv = inventory.Inventory(filename)
+
+    assert len(inv) == 3
+    assert list(inv.contents()) == ['a', 'b', 'c']
+
+    inv.append('d')
+    assert list(inv.contents()) == ['a', 'b', 'c', 'd']
+    assert inv[3] == 'd'
+
+
+def test_segmented_appends_wait_for_compaction(tmp_path):
+    inv = inventory.SegmentedInventory(str(tmp_path / 'inventory.d'))
+    inv.segment_size = 200
+    inv.compact_segments = 3
+
+    for i in range(300):
+        inv.append('spool/entry-{:04}.txt'.format(i % 150))
+        len(inv)
+
+    inv.close()
+
+    assert set(inv.contents()) == {
+            'spool/entry-{:04}.txt'.format(i) for i in range(150)
+            }
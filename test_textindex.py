@@ -0,0 +1,24 @@
+import textindex
+
+
+def test_exact_word_beats_rare_prefix_match(tmp_path):
+    index = textindex.TextIndex(str(tmp_path / 'inventory.search'))
+
+    index.add_texts(
+            [
+                ('zip{:02}.txt'.format(i), 'Hardware\nzip ties {:}'.format(i))
+                for i in range(20)
+                ]
+            + [('jacket.txt', 'winter jacket with zipper pocket')]
+            )
+
+    results = index.search('zip ties', limit=21)
+
+    assert results[-1].path == 'jacket.txt'
+    assert index.search('zipper')[0].path == 'jacket.txt'
+
+
+def test_tokenize_casefolds_unicode_words():
+    assert textindex.tokenize('Große STRASSE, café') == [
+            'grosse', 'strasse', 'café',
+            ]
@@ -0,0 +1,302 @@
+#!/usr/bin/python3
+
+import collections
+import heapq
+import json
+import math
+import re
+import sys
+
+import sqliteconn
+
+
+SearchResult = collections.namedtuple('SearchResult', ('path', 'score'))
+
+
+def tokenize(text):
+    return re.findall(r'\w+', text.casefold())
+
+
+def read_text(path):
+    """
+    The searchable text of a spooled .txt or .json file, or None if it is
+    neither or cannot be read. Of a JSON document, all strings count.
+    """
+    lower = path.lower()
+
+    try:
+        with open(path, 'r') as F:
+            if lower.endswith('.txt'):
+                return F.read()
+
+            if lower.endswith('.json'):
+                return ' '.join(json_strings(json.load(F)))
+    except (OSError, UnicodeDecodeError, ValueError):
+        pass
+
+    return None
+
+
+def json_strings(value):
+    if isinstance(value, str):
+        yield value
+    elif isinstance(value, dict):
+        for key, item in value.items():
+            yield from json_strings(item)
+    elif isinstance(value, list):
+        for item in value:
+            yield from json_strings(item)
+
+
+def index_filename(inventory_filename):
+    return inventory_filename + '.search'
+
+
+class TextIndex(object):
+    """
+    Inverted index from tokens to the inventory entries whose spooled text
+    contains them, kept in an SQLite database so it is updated one entry at
+    a time and searched without rereading the spool.
+
+    search() ranks by BM25. Query terms of at least prefix_length
+    characters also match longer tokens starting with them, so 'tie' finds
+    'ties', but such a match counts only prefix_weight of an exact one.
+    """
+
+    k1 = 1.2
+    b = 0.75
+    prefix_length = 3
+    prefix_weight = 0.5
+
+    schema = (
+            """
+            CREATE TABLE IF NOT EXISTS documents (
+                id INTEGER PRIMARY KEY,
+                path TEXT UNIQUE NOT NULL,
+                length INTEGER NOT NULL
+                )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS postings (
+                token TEXT NOT NULL,
+                document INTEGER NOT NULL,
+                count INTEGER NOT NULL,
+                PRIMARY KEY (token, document)
+                ) WITHOUT ROWID
+            """,
+            """
+            CREATE INDEX IF NOT EXISTS postings_document
+                ON postings (document)
+            """,
+            )
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._connections = sqliteconn.ThreadConnections(
+                filename,
+                timeout=5,
+                )
+
+        with self._connection() as connection:
+            for statement in self.schema:
+                connection.execute(statement)
+
+
+    def _connection(self):
+        return self._connections.get()
+
+
+    def add_paths(self, paths):
+        """
+        Index the spooled files among paths. Other entries are skipped.
+        """
+        texts = []
+
+        for path in paths:
+            text = read_text(path)
+            if text is not None:
+                texts.append((path, text))
+
+        self.add_texts(texts)
+
+
+    def add_texts(self, texts):
+        """
+        Index (path, text) pairs in one transaction. A path that is already
+        indexed is replaced, as when a label is reprinted with a new
+        description.
+        """
+        connection = self._connection()
+
+        with connection:
+            for path, text in texts:
+                counts = collections.Counter(tokenize(text))
+                length = sum(counts.values())
+
+                row = connection.execute(
+                        'SELECT id FROM documents WHERE path = ?',
+                        (path,),
+                        ).fetchone()
+
+                if row:
+                    document, = row
+                    connection.execute(
+                            'DELETE FROM postings WHERE document = ?',
+                            (document,),
+                            )
+                    connection.execute(
+                            'UPDATE documents SET length = ? WHERE id = ?',
+                            (length, document),
+                            )
+                else:
+                    document = connection.execute(
+                            'INSERT INTO documents (path, length) VALUES (?, ?)',
+                            (path, length),
+                            ).lastrowid
+
+                connection.executemany(
+                        'INSERT INTO postings VALUES (?, ?, ?)',
+                        (
+                            (token, document, count)
+                            for token, count in counts.items()
+                            ),
+                        )
+
+
+    def __len__(self):
+        cursor = self._connection().execute('SELECT count(*) FROM documents')
+        return cursor.fetchone()[0]
+
+
+    def _postings(self, term):
+        if len(term) >= self.prefix_length:
+            return self._connection().execute(
+                    """
+                    SELECT token, document, count FROM postings
+                    WHERE token >= ? AND token < ?
+                    """,
+                    (term, term + '\uffff'),
+                    )
+
+        return self._connection().execute(
+                'SELECT token, document, count FROM postings WHERE token = ?',
+                (term,),
+                )
+
+
+    def search(self, query, limit=10):
+        """
+        The best limit entries for query, as SearchResult(path, score) with
+        the highest score first.
+        """
+        connection = self._connection()
+
+        documents, total_length = connection.execute(
+                'SELECT count(*), total(length) FROM documents',
+                ).fetchone()
+
+        if not documents:
+            return []
+
+        average_length = total_length / documents
+
+        weighted = []
+        candidates = set()
+
+        for term in set(tokenize(query)):
+            # Every document the term matches, exactly or by prefix, counts
+            # once towards its idf; prefix matches weigh less than the word.
+            counts = collections.defaultdict(float)
+            for token, document, count in self._postings(term):
+                if token == term:
+                    counts[document] += count
+                else:
+                    counts[document] += self.prefix_weight * count
+
+            idf = math.log(
+                    1 + (documents - len(counts) + 0.5)
+                    / (len(counts) + 0.5)
+                    )
+
+            weighted.append((idf, counts))
+            candidates.update(counts)
+
+        # The length normalisation needs every candidate's length; fetch
+        # them in a few queries rather than one per posting.
+        lengths = self._select(
+                'SELECT id, length FROM documents WHERE id IN ({:})',
+                candidates,
+                )
+
+        scores = collections.defaultdict(float)
+
+        for idf, counts in weighted:
+            for document, count in counts.items():
+                norm = 1 - self.b + self.b * lengths[document] / average_length
+                scores[document] += (
+                        idf * count * (self.k1 + 1)
+                        / (count + self.k1 * norm)
+                        )
+
+        best = heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
+
+        paths = self._select(
+                'SELECT id, path FROM documents WHERE id IN ({:})',
+                [document for document, score in best],
+                )
+
+        return [
+                SearchResult(paths[document], score)
+                for document, score in best
+                ]
+
+
+    def _select(self, query, ids, chunk_size=500):
+        """
+        Run query, whose IN list is left as {:}, over ids in chunks and
+        collect the (id, value) rows into a dict.
+        """
+        ids = list(ids)
+        rows = {}
+
+        for start in range(0, len(ids), chunk_size):
+            chunk = ids[start:start + chunk_size]
+            rows.update(self._connection().execute(
+                query.format(', '.join('?' * len(chunk))),
+                chunk,
+                ))
+
+        return rows
+
+
+    def close(self):
+        self._connections.close()
+
+
+def rebuild(inventory_filename):
+    """
+    Index every entry of an existing inventory. Returns the number of
+    entries indexed.
+    """
+    import inventory
+
+    index = TextIndex(index_filename(inventory_filename))
+    store = inventory.load(inventory_filename, text_index=False)
+
+    paths = list(store.contents())
+    index.add_paths(paths)
+
+    return len(index)
+
+
+if __name__ == '__main__':
+    # textindex.py INVENTORY QUERY...    search the entries of INVENTORY
+    # textindex.py --rebuild INVENTORY   index an existing inventory
+    if sys.argv[1] == '--rebuild':
+        print(rebuild(sys.argv[2]), 'entries indexed')
+        sys.exit(0)
+
+    index = TextIndex(index_filename(sys.argv[1]))
+
+    for result in index.search(' '.join(sys.argv[2:])):
+        print('{:8.3f}  {:}'.format(result.score, result.path))